@@ -0,0 +1,10 @@
+-- Keys of the last writes applied by the progress outbox (PROGRESS_OUTBOX_PATH).
+-- The replayer stores its key in the same statement as the write, so a write
+-- replayed after a lost response is recognised and not applied twice.
+-- Required before enabling the outbox; harmless otherwise.
+
+alter table public.daily_work_registry
+    add column if not exists applied_writes text[] not null default '{}';
+
+alter table public.character_progress
+    add column if not exists applied_writes text[] not null default '{}';
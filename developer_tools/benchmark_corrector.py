@@ -0,0 +1,192 @@
+"""
+Corrector Benchmark Suite
+Replay realistic answers built from the content files against every alignment engine,
+report latency percentiles and allocations, and check throughput against a baseline.
+
+Usage:
+    python developer_tools/benchmark_corrector.py                  # report only
+    python developer_tools/benchmark_corrector.py --save-baseline  # record current numbers
+    python developer_tools/benchmark_corrector.py --check          # exit 1 on regression
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dictation.alignment import ENGINES
+from dictation.corrector import Corrector, TargetProfile
+
+BASELINE_PATH = os.path.join(ROOT, "developer_tools", "corrector_benchmark_baseline.json")
+MAX_INPUT_LENGTH = 1000  # FormHandler.validate_user_input limit
+
+
+def load_sentences():
+    """Every correct sentence in sentences.json, stories.json and conversations.json"""
+    with open(os.path.join(ROOT, "sentences.json"), encoding="utf-8") as f:
+        sentences = [s["chinese"] for s in json.load(f).values()]
+    with open(os.path.join(ROOT, "stories.json"), encoding="utf-8") as f:
+        sentences += [part["chinese"] for story in json.load(f).values() for part in story["parts"]]
+    with open(os.path.join(ROOT, "conversations.json"), encoding="utf-8") as f:
+        sentences += [sent["chinese"] for conv in json.load(f) for sent in conv["sentences"]]
+    return sentences
+
+
+def build_corpus(sentences, rng, per_scenario=200):
+    """Map scenario name to a list of (user_input, correct) pairs"""
+    alphabet = "".join(sorted({ch for s in sentences for ch in s if '一' <= ch <= '鿿'}))
+
+    def typos(text):
+        return "".join(rng.choice(alphabet) if rng.random() < 0.15 else ch for ch in text)
+
+    def omissions(text):
+        return "".join(ch for ch in text if rng.random() >= 0.2)
+
+    def garbage(text):
+        return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 2 * len(text))))
+
+    picks = [rng.choice(sentences) for _ in range(per_scenario)]
+    corpus = {
+        "perfect": [(s, s) for s in picks],
+        "typos": [(typos(s), s) for s in picks],
+        "omissions": [(omissions(s), s) for s in picks],
+        "garbage": [(garbage(s), s) for s in picks],
+    }
+    # Pasted whole stories at the input limit, against a long target
+    long_pairs = []
+    for _ in range(3):
+        target = ""
+        while len(target) < MAX_INPUT_LENGTH:
+            target += rng.choice(sentences)
+        target = target[:MAX_INPUT_LENGTH]
+        long_pairs.append((typos(target), target))
+    corpus["max-length"] = long_pairs
+    return corpus
+
+
+def calibrate(rounds=5):
+    """Seconds for a fixed pure-Python workload (best of rounds), used to normalise machine speed"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        total = 0
+        for i in range(500_000):
+            total += i % 7
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_scenario(corrector, pairs, rounds=3):
+    """Latency percentiles (ms), throughput (calls/s) and mean peak allocation (KiB)"""
+    targets = [(user, TargetProfile(correct)) for user, correct in pairs]
+    # Best of several rounds per call, so scheduler noise does not read as a regression
+    latencies = [float("inf")] * len(targets)
+    for _ in range(rounds):
+        for k, (user, target) in enumerate(targets):
+            start = time.perf_counter()
+            corrector.align(user, target).render()
+            latencies[k] = min(latencies[k], time.perf_counter() - start)
+    peaks = []
+    for user, target in targets[:20]:
+        tracemalloc.start()
+        corrector.align(user, target).render()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    latencies.sort()
+    return {
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "calls_per_s": len(latencies) / sum(latencies),
+        "peak_kib": sum(peaks) / len(peaks) / 1024,
+    }
+
+
+def run(engines, per_scenario):
+    rng = random.Random(2024)
+    corpus = build_corpus(load_sentences(), rng, per_scenario)
+    results = {}
+    for engine in engines:
+        # No cache and no automatic engine switch: measure the engine itself
+        corrector = Corrector(engine, linear_threshold=sys.maxsize, cache=None)
+        results[engine] = {
+            # The table engine needs ~0.5 s per max-length answer; one round is enough
+            name: run_scenario(corrector, pairs, rounds=1 if engine == "dp" and name == "max-length" else 3)
+            for name, pairs in corpus.items()
+        }
+    return results
+
+
+def print_report(results):
+    print("⏱️  Corrector benchmark (cache disabled)")
+    for engine, scenarios in results.items():
+        print(f"\n🔧 {engine}")
+        print(f"   {'scenario':<11} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'calls/s':>10} {'peak KiB':>10}")
+        for name, r in scenarios.items():
+            print(f"   {name:<11} {r['p50_ms']:9.3f} {r['p90_ms']:9.3f} {r['p99_ms']:9.3f} {r['calls_per_s']:10.1f} {r['peak_kib']:10.1f}")
+
+
+def engine_throughput(scenarios):
+    """Geometric mean of calls/s over the scenarios, steadier than any single one"""
+    logs = [math.log(r["calls_per_s"]) for r in scenarios.values()]
+    return math.exp(sum(logs) / len(logs))
+
+
+def check(results, baseline, calibration, threshold):
+    """Return the engines whose throughput dropped by more than `threshold` (a fraction)"""
+    # Normalise to the baseline machine's speed before comparing
+    scale = calibration / baseline["calibration_s"]
+    failures = []
+    for engine, scenarios in results.items():
+        expected_scenarios = baseline["results"].get(engine)
+        if expected_scenarios is None:
+            continue
+        expected = engine_throughput(expected_scenarios)
+        current = engine_throughput(scenarios) * scale
+        if current < expected * (1 - threshold):
+            failures.append(f"{engine}: {current:.1f} calls/s vs baseline {expected:.1f} (geometric mean over scenarios)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--per-scenario", type=int, default=200, help="answers per scenario")
+    parser.add_argument("--check", action="store_true", help="fail if throughput regressed against the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed throughput drop (default 25%%)")
+    parser.add_argument("--save-baseline", action="store_true", help=f"write results to {os.path.relpath(BASELINE_PATH, ROOT)}")
+    args = parser.parse_args()
+
+    calibration = calibrate()
+    results = run(args.engines, args.per_scenario)
+    print_report(results)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"calibration_s": calibration, "results": results}, f, indent=2)
+        print(f"\n💾 Baseline saved to {os.path.relpath(BASELINE_PATH, ROOT)}")
+
+    if args.check:
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = check(results, baseline, calibration, args.threshold)
+        if failures:
+            print(f"\n❌ Throughput regressed by more than {args.threshold:.0%}:")
+            for failure in failures:
+                print(f"   {failure}")
+            sys.exit(1)
+        print(f"\n✅ No throughput regression beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
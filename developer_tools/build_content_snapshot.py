@@ -0,0 +1,36 @@
+"""
+Content Snapshot Builder
+Compiles the JSON content and its derived indexes into content_snapshot.pickle,
+which DictationContext loads at startup instead of the JSON files
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from dictation.app_context import DictationContext, SNAPSHOT_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the content snapshot loaded by DictationContext")
+    parser.add_argument("--output", default=SNAPSHOT_PATH or "content_snapshot.pickle", help="Snapshot path")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ctx = DictationContext(snapshot_path=None)
+    json_ms = (time.perf_counter() - start) * 1000
+    fingerprint = ctx.save_snapshot(args.output)
+    print(f"📦 Wrote {args.output} ({os.path.getsize(args.output) / 1024:.0f} KB, fingerprint {fingerprint[:12]})")
+
+    start = time.perf_counter()
+    DictationContext(snapshot_path=args.output)
+    snapshot_ms = (time.perf_counter() - start) * 1000
+    print(f"⏱️  Startup from JSON: {json_ms:.1f} ms, from snapshot: {snapshot_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Corrector Memory Benchmark
+Measure peak memory allocated by one Corrector.compare call per alignment engine
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dictation.alignment import ENGINES
+from dictation.corrector import Corrector
+
+ALPHABET = "的一是不了人我在有他这中大来上个国到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可里后"
+SIZES = [10, 50, 200, 500, 1000]
+
+
+def make_pair(size, rng):
+    """Correct text of `size` hanzi and a user answer with ~10% typos"""
+    correct = "".join(rng.choice(ALPHABET) for _ in range(size))
+    user = "".join(rng.choice(ALPHABET) if rng.random() < 0.1 else ch for ch in correct)
+    return user, correct
+
+
+def measure(corrector, user, correct):
+    """Return (peak KiB, milliseconds) for a single compare call"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    corrector.compare(user, correct)
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024, elapsed
+
+
+def main():
+    rng = random.Random(42)
+    pairs = {size: make_pair(size, rng) for size in SIZES}
+    # Disable the automatic switch so every engine is measured on its own, and the
+    # correction cache so that each engine aligns the pairs instead of reading them back
+    correctors = {name: Corrector(name, linear_threshold=sys.maxsize, cache=None) for name in ENGINES}
+
+    print("📏 Peak allocation per compare() call")
+    print(f"   {'chars':>6} " + " ".join(f"{name:>22}" for name in correctors))
+    for size, (user, correct) in pairs.items():
+        cells = []
+        for corrector in correctors.values():
+            peak_kib, elapsed_ms = measure(corrector, user, correct)
+            cells.append(f"{peak_kib:9.1f} KiB {elapsed_ms:7.1f} ms")
+        print(f"   {size:>6} " + " ".join(f"{cell:>22}" for cell in cells))
+
+
+if __name__ == "__main__":
+    main()
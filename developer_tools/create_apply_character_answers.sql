@@ -0,0 +1,74 @@
+-- Atomic grade updates for character_progress, called by the app through
+-- supabase.rpc("apply_character_answers", ...) (dictation/db_helpers.py).
+--
+-- Applies a batch of answers in one call: every answer moves the grade of
+-- its character by one step inside a single upsert, so two tabs answering
+-- at the same time cannot overwrite each other's grades. Same rules as
+-- db_helpers.next_grade: a new character starts at 0 (correct) or -1,
+-- then correct answers add 1 up to 3 and wrong answers subtract 1 down to 0.
+--
+-- p_answers: [{"hanzi": "你", "hsk_level": 1, "correct": true}, ...] in the
+-- order the answers were given (a character may appear several times).
+-- p_write_key: outbox key of the batch (PROGRESS_OUTBOX_PATH), or null.
+-- Characters that already applied this key are skipped, so a replayed
+-- batch is applied only once.
+--
+-- The upsert between the "begin upsert" and "end upsert" markers is also
+-- run by unittest/test_grade_function.py against SQLite; keep it portable.
+
+-- applied_writes (also added by add_applied_writes_columns.sql)
+alter table public.character_progress
+    add column if not exists applied_writes text[] not null default '{}';
+
+create or replace function public.apply_character_answers(
+    p_user_id uuid,
+    p_answers jsonb,
+    p_write_key text default null
+)
+returns void
+language plpgsql
+security invoker
+as $$
+declare
+    v_answer jsonb;
+    v_hanzi text;
+    v_hsk_level int;
+    v_correct boolean;
+    v_skipped text[] := '{}';
+    v_written text[] := '{}';
+begin
+    if p_write_key is not null then
+        select coalesce(array_agg(hanzi), '{}') into v_skipped
+        from public.character_progress
+        where user_id = p_user_id and p_write_key = any(applied_writes);
+    end if;
+
+    for v_answer in select value from jsonb_array_elements(p_answers) loop
+        v_hanzi := v_answer->>'hanzi';
+        v_hsk_level := (v_answer->>'hsk_level')::int;
+        v_correct := (v_answer->>'correct')::boolean;
+        continue when v_hanzi = any(v_skipped);
+
+        -- begin upsert
+        insert into public.character_progress as cp (user_id, hanzi, hsk_level, grade, last_seen)
+        values (p_user_id, v_hanzi, v_hsk_level, case when v_correct then 0 else -1 end, now())
+        on conflict (user_id, hanzi) do update
+        set grade = case when v_correct then least(cp.grade + 1, 3) else greatest(cp.grade - 1, 0) end,
+            hsk_level = excluded.hsk_level,
+            last_seen = excluded.last_seen;
+        -- end upsert
+
+        v_written := array_append(v_written, v_hanzi);
+    end loop;
+
+    if p_write_key is not null then
+        update public.character_progress
+        set applied_writes = (applied_writes || p_write_key)[greatest(cardinality(applied_writes) - 18, 1):]
+        where user_id = p_user_id and hanzi = any(v_written);
+    end if;
+end;
+$$;
+
+grant execute on function public.apply_character_answers(uuid, jsonb, text) to anon, authenticated, service_role;
+
+comment on function public.apply_character_answers(uuid, jsonb, text) is 'Applies a batch of dictation answers to character_progress grades atomically';
@@ -0,0 +1,64 @@
+"""
+HSK Level Lookup Benchmark
+Per-submission cost of finding the HSK level of every hanzi in the answered sentence
+(linear scan, hanzi_levels index, precomputed update plan)
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from dictation.app_context import DictationContext
+
+
+def levels_by_scan(ctx, text):
+    """Previous implementation: scan hsk_data for every distinct hanzi"""
+    levels = []
+    for hanzi in set(text):
+        match = next((entry for entry in ctx.hsk_data if entry["hanzi"] == hanzi), None)
+        if match:
+            hsk_level = match["hsk_level"]
+            if isinstance(hsk_level, str) and hsk_level.startswith("HSK"):
+                levels.append((hanzi, int(hsk_level.replace("HSK", ""))))
+            else:
+                levels.append((hanzi, int(hsk_level)))
+    return levels
+
+
+def levels_by_index(ctx, text):
+    """DictationContext.hanzi_levels lookup"""
+    levels = []
+    for hanzi in set(text):
+        level = ctx.hanzi_levels.get(hanzi)
+        if level is not None:
+            levels.append((hanzi, level))
+    return levels
+
+
+def levels_by_plan(ctx, text):
+    """DictationContext update plan, precomputed per sentence"""
+    return [(hanzi, level) for hanzi, level, _ in ctx.get_update_plan(text)]
+
+
+def main(number=20):
+    ctx = DictationContext()
+    corpora = {
+        "sentences": [s["chinese"] for s in ctx.sentences.values()],
+        "story parts": [p["chinese"] for story in ctx.stories.values() for p in story["parts"]],
+        "conversation lines": [s["chinese"] for conv in ctx.conversations.values() for s in conv["sentences"]],
+    }
+    print(f"🈶 HSK level lookups ({len(ctx.hsk_data)} characters in hsk_characters.json)")
+    for label, texts in corpora.items():
+        assert all(sorted(levels_by_scan(ctx, t)) == sorted(levels_by_index(ctx, t)) == sorted(levels_by_plan(ctx, t)) for t in texts)
+        old = timeit.timeit(lambda: [levels_by_scan(ctx, t) for t in texts], number=number)
+        new = timeit.timeit(lambda: [levels_by_index(ctx, t) for t in texts], number=number)
+        plan = timeit.timeit(lambda: [levels_by_plan(ctx, t) for t in texts], number=number)
+        per_submission = 1e6 / (number * len(texts))
+        print(f"   {label:<20} scan {old * per_submission:8.1f} µs   index {new * per_submission:6.2f} µs   plan {plan * per_submission:6.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Punctuation Stripping Benchmark
+Compare the per-character unicodedata classifier with the corrector's translate table
+"""
+import json
+import os
+import sys
+import timeit
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dictation.corrector import strip_punct_and_space
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def strip_per_char(text):
+    """Previous implementation: one unicodedata lookup per character"""
+    return ''.join(ch for ch in text if not unicodedata.category(ch).startswith('P') and not ch.isspace())
+
+
+def load_texts():
+    """Story parts, conversation lines and their pinyin, as typed by learners"""
+    with open(os.path.join(ROOT, "stories.json"), encoding="utf-8") as f:
+        stories = json.load(f)
+    with open(os.path.join(ROOT, "conversations.json"), encoding="utf-8") as f:
+        conversations = json.load(f)
+    parts = [part for story in stories.values() for part in story["parts"]]
+    lines = [sent for conv in conversations for sent in conv["sentences"]]
+    return {
+        "story hanzi": [p["chinese"] for p in parts],
+        "conversation hanzi": [s["chinese"] for s in lines],
+        "story pinyin": [p["pinyin"] for p in parts],
+    }
+
+
+def main(number=2000):
+    print("✂️  Stripping punctuation and whitespace")
+    for label, texts in load_texts().items():
+        assert all(strip_per_char(t) == strip_punct_and_space(t) for t in texts)
+        old = timeit.timeit(lambda: [strip_per_char(t) for t in texts], number=number)
+        new = timeit.timeit(lambda: [strip_punct_and_space(t) for t in texts], number=number)
+        per_text = 1e6 / (number * len(texts))
+        print(f"   {label:<20} unicodedata {old * per_text:6.2f} µs   translate {new * per_text:6.2f} µs   {old / new:5.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
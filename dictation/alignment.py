@@ -0,0 +1,366 @@
+"""
+Alignment engines for the corrector.
+
+Every engine takes the stripped user text and the stripped correct text and
+returns the list of edit operations ``(op, user_index, correct_index)`` that
+``Corrector.compare`` renders, where ``op`` is one of ``equal``, ``replace``,
+``insert`` or ``delete``. All engines walk back through the same edit-distance
+matrix with the same tie-breaking, so they return identical operations and the
+choice of engine only affects speed and memory.
+"""
+
+import os
+import threading
+
+
+def _walk_back(distance, s_user, s_correct, i, j, stop_j, ops):
+    """
+    Walk back from cell (i, j), appending operations to ``ops`` in reverse.
+
+    ``distance(i, j)`` returns the edit distance between the first ``i`` user
+    characters and the first ``j`` correct characters. The walk stops when it
+    reaches column ``stop_j`` (or (0, 0) when ``stop_j`` is 0) and returns the
+    row it stopped on.
+    """
+    while j > stop_j or (j == 0 and i > 0):
+        if i > 0 and j > 0 and s_user[i-1] == s_correct[j-1]:
+            ops.append(('equal', i-1, j-1))
+            i -= 1
+            j -= 1
+            continue
+        current = distance(i, j)
+        if i > 0 and j > 0 and current == distance(i-1, j-1) + 1:
+            ops.append(('replace', i-1, j-1))
+            i -= 1
+            j -= 1
+        elif j > 0 and current == distance(i, j-1) + 1:
+            ops.append(('insert', None, j-1))
+            j -= 1
+        else:
+            ops.append(('delete', i-1, None))
+            i -= 1
+    return i
+
+
+def _walk(distance, s_user, s_correct, i, j):
+    """Walk back from cell (i, j) to (0, 0) and return the operations in order."""
+    ops = []
+    _walk_back(distance, s_user, s_correct, i, j, 0, ops)
+    ops.reverse()
+    return ops
+
+
+def dp_align(s_user, s_correct):
+    """Classic Levenshtein table with one Python list per row."""
+    n, m = len(s_user), len(s_correct)
+    dp = [[0] * (m+1) for _ in range(n+1)]
+    for i in range(n+1): dp[i][0] = i
+    for j in range(m+1): dp[0][j] = j
+    for i in range(1, n+1):
+        for j in range(1, m+1):
+            if s_user[i-1] == s_correct[j-1]:
+                dp[i][j] = dp[i-1][j-1]
+            else:
+                dp[i][j] = 1 + min(dp[i-1][j],    # deletion
+                                   dp[i][j-1],    # insertion
+                                   dp[i-1][j-1])  # substitution
+    return _walk(lambda i, j: dp[i][j], s_user, s_correct, n, m)
+
+
+def _match_masks(s_user):
+    """Map every user character to the bitmask of the positions where it occurs."""
+    peq = {}
+    bit = 1
+    for ch in s_user:
+        peq[ch] = peq.get(ch, 0) | bit
+        bit <<= 1
+    return peq
+
+
+def _advance_column(peq, mask, pv, mv, ch):
+    """
+    Compute the next column of vertical deltas (Myers/Hyyrö step).
+
+    Bit ``i-1`` of ``pv``/``mv`` is set when D[i][j] - D[i-1][j] is +1/-1.
+    The top row of the matrix grows by one per column (global distance),
+    hence the ``| 1`` carried into the horizontal positive delta.
+    """
+    eq = peq.get(ch, 0)
+    xv = eq | mv
+    xh = (((eq & pv) + pv) ^ pv) | eq
+    ph = mv | (~(xh | pv) & mask)
+    mh = pv & xh
+    ph = ((ph << 1) | 1) & mask
+    mh = (mh << 1) & mask
+    return mh | (~(xv | ph) & mask), ph & xv
+
+
+def _column_distance(pvs, mvs, first):
+    """Cell lookup over stored delta columns, ``pvs[0]`` being column ``first``."""
+    def distance(i, j):
+        rows = (1 << i) - 1
+        return j + (pvs[j - first] & rows).bit_count() - (mvs[j - first] & rows).bit_count()
+    return distance
+
+
+def bitparallel_align(s_user, s_correct):
+    """
+    Bit-parallel edit distance (Myers 1999, Hyyrö 2001).
+
+    Each column of the matrix is stored as two integers holding its vertical
+    deltas, so filling it costs O(m * n / w) word operations instead of n * m
+    Python-level cell updates. Any cell is recovered on demand during the
+    walk back by counting the deltas above it.
+    """
+    n = len(s_user)
+    peq = _match_masks(s_user)
+    mask = (1 << n) - 1
+    pv, mv = mask, 0
+    pvs, mvs = [pv], [mv]
+    for ch in s_correct:
+        pv, mv = _advance_column(peq, mask, pv, mv, ch)
+        pvs.append(pv)
+        mvs.append(mv)
+    return _walk(_column_distance(pvs, mvs, 0), s_user, s_correct, n, len(s_correct))
+
+
+class VariantTrie:
+    """
+    Stripped answer variants stored as a trie, so that variants sharing a
+    prefix (一个人 / 一个人呢) also share the matrix columns of that prefix.
+
+    Nodes are numbered so that a parent always precedes its children;
+    ``chars[k]`` is the character leading into node k (node 0 is the root)
+    and ``ends[v]`` the node where variant v ends.
+    """
+    __slots__ = ("variants", "chars", "parents", "depths", "ends")
+
+    def __init__(self, variants):
+        self.variants = tuple(variants)
+        self.chars = ['']
+        self.parents = [-1]
+        self.depths = [0]
+        children = [{}]
+        ends = []
+        for variant in self.variants:
+            node = 0
+            for ch in variant:
+                child = children[node].get(ch)
+                if child is None:
+                    child = children[node][ch] = len(self.chars)
+                    self.chars.append(ch)
+                    self.parents.append(node)
+                    self.depths.append(self.depths[node] + 1)
+                    children.append({})
+                node = child
+            ends.append(node)
+        self.ends = tuple(ends)
+
+
+def trie_align(trie, s_user):
+    """
+    Align the user text with every variant of a VariantTrie at once.
+
+    Each trie node costs one bit-parallel column, so N variants cost about
+    one alignment plus their non-shared suffixes. Returns the index of the
+    closest variant (the first one on ties) and its operations, which are
+    the same as ``bitparallel_align(s_user, variant)``.
+    """
+    n = len(s_user)
+    peq = _match_masks(s_user)
+    mask = (1 << n) - 1
+    pvs, mvs = [mask], [0]
+    parents, chars = trie.parents, trie.chars
+    for k in range(1, len(chars)):
+        parent = parents[k]
+        pv, mv = _advance_column(peq, mask, pvs[parent], mvs[parent], chars[k])
+        pvs.append(pv)
+        mvs.append(mv)
+    best = min(range(len(trie.ends)), key=lambda v: trie.depths[trie.ends[v]]
+               + pvs[trie.ends[v]].bit_count() - mvs[trie.ends[v]].bit_count())
+    path = []
+    node = trie.ends[best]
+    while node != -1:
+        path.append(node)
+        node = parents[node]
+    path.reverse()
+    variant = trie.variants[best]
+    distance = _column_distance([pvs[k] for k in path], [mvs[k] for k in path], 0)
+    return best, _walk(distance, s_user, variant, n, len(variant))
+
+
+LINEAR_BLOCK_COLUMNS = 32
+
+
+def linear_align(s_user, s_correct):
+    """
+    Linear-space alignment in the spirit of Hirschberg's divide and conquer.
+
+    Only the delta columns of the current block and one checkpoint column per
+    recursion level are kept alive, so memory is O(n / w * (block + log m))
+    words. The right half of the matrix is resolved first to find the row on
+    which the walk back enters the middle column, then the left half continues
+    from there. Unlike the textbook midpoint split this follows exactly the
+    same path as the full-table walk, so the operations are identical.
+    """
+    n, m = len(s_user), len(s_correct)
+    peq = _match_masks(s_user)
+    mask = (1 << n) - 1
+    ops = []
+
+    def walk_columns(first, pv0, mv0, last, i):
+        if last - first <= LINEAR_BLOCK_COLUMNS:
+            pv, mv = pv0, mv0
+            pvs, mvs = [pv], [mv]
+            for ch in s_correct[first:last]:
+                pv, mv = _advance_column(peq, mask, pv, mv, ch)
+                pvs.append(pv)
+                mvs.append(mv)
+            return _walk_back(_column_distance(pvs, mvs, first), s_user, s_correct, i, last, first, ops)
+        middle = (first + last) // 2
+        pv, mv = pv0, mv0
+        for ch in s_correct[first:middle]:
+            pv, mv = _advance_column(peq, mask, pv, mv, ch)
+        i = walk_columns(middle, pv, mv, last, i)
+        return walk_columns(first, pv0, mv0, middle, i)
+
+    walk_columns(0, mask, 0, m, n)
+    ops.reverse()
+    return ops
+
+
+def banded_align(s_user, s_correct, max_distance):
+    """
+    Edit distance restricted to the diagonal band |i - j| <= max_distance.
+
+    Returns None as soon as the distance is known to exceed the budget,
+    otherwise the same operations as the full table: every cell on an
+    alignment within budget lies inside the band, and a neighbour outside it
+    can never tie with the cell being walked from. Costs O((n + m) * k).
+    """
+    n, m = len(s_user), len(s_correct)
+    k = max_distance
+    if abs(n - m) > k:
+        return None
+    too_far = k + 1
+    rows = [list(range(min(m, k) + 1))]
+    for i in range(1, n+1):
+        lo, hi = max(0, i - k), min(m, i + k)
+        prev, prev_lo = rows[-1], max(0, i - 1 - k)
+        prev_hi = prev_lo + len(prev) - 1
+        row = []
+        ch = s_user[i-1]
+        for j in range(lo, hi + 1):
+            up = prev[j - prev_lo] if j <= prev_hi else too_far
+            if j == 0:
+                row.append(min(up + 1, too_far))
+                continue
+            diag = prev[j - 1 - prev_lo] if j - 1 >= prev_lo else too_far
+            if ch == s_correct[j-1]:
+                value = diag
+            else:
+                left = row[-1] if j > lo else too_far
+                value = 1 + min(up, left, diag)
+            row.append(min(value, too_far))
+        if min(row) > k:
+            return None
+        rows.append(row)
+    if rows[n][m - max(0, n - k)] > k:
+        return None
+
+    def distance(i, j):
+        lo = max(0, i - k)
+        if j < lo or j - lo >= len(rows[i]):
+            return too_far
+        return rows[i][j - lo]
+
+    return _walk(distance, s_user, s_correct, n, m)
+
+
+class IncrementalAligner:
+    """
+    Edit-distance table of a growing user text against a fixed correct text,
+    one row per user character, for corrections while the learner types.
+
+    ``extend`` keeps the rows of the characters shared with the previous text
+    and only computes rows for the new ones, so appending a character costs
+    O(m / w) word operations instead of a full alignment. Rows are stored
+    like the columns of ``bitparallel_align``, as two integers holding their
+    horizontal deltas (the matrix is transposed: the correct text is the
+    fixed side), so a session's state stays a few bytes per typed character.
+    ``prefix_ops`` aligns the user text with the best-matching prefix of the
+    correct text (the learner has not typed the rest yet), using the same
+    walk-back as the other engines.
+    """
+    __slots__ = ("s_correct", "s_user", "peq", "mask", "rows", "lock")
+
+    def __init__(self, s_correct):
+        self.s_correct = s_correct
+        self.s_user = ""
+        self.peq = _match_masks(s_correct)
+        self.mask = (1 << len(s_correct)) - 1
+        # Row 0 grows by one per correct character
+        self.rows = [(self.mask, 0)]
+        # Requests of one session can overlap (threaded workers)
+        self.lock = threading.Lock()
+
+    def extend(self, s_user):
+        """Move to ``s_user`` and return the number of rows that were computed."""
+        previous = self.s_user
+        common = 0
+        limit = min(len(previous), len(s_user))
+        while common < limit and previous[common] == s_user[common]:
+            common += 1
+        del self.rows[common + 1:]
+        pv, mv = self.rows[-1]
+        for ch in s_user[common:]:
+            pv, mv = _advance_column(self.peq, self.mask, pv, mv, ch)
+            self.rows.append((pv, mv))
+        self.s_user = s_user
+        return len(s_user) - common
+
+    def prefix_ops(self):
+        """
+        Operations aligning the whole user text with the correct prefix it is
+        closest to (the longest one on ties), and the length of that prefix.
+        """
+        n = len(self.s_user)
+        pv, mv = self.rows[-1]
+        best = current = n
+        end = 0
+        for j in range(len(self.s_correct)):
+            current += (pv >> j & 1) - (mv >> j & 1)
+            if current <= best:
+                best, end = current, j + 1
+        pvs = [pv for pv, _ in self.rows]
+        mvs = [mv for _, mv in self.rows]
+        cell = _column_distance(pvs, mvs, 0)
+        ops = _walk(lambda i, j: cell(j, i), self.s_user, self.s_correct, n, end)
+        return ops, end
+
+
+ENGINES = {
+    "dp": dp_align,
+    "bitparallel": bitparallel_align,
+    "linear": linear_align,
+}
+
+DEFAULT_ENGINE = os.environ.get("CORRECTOR_ENGINE", "bitparallel")
+
+# Above this many stripped characters on either side the corrector switches to
+# the linear-space engine, whatever engine it was configured with.
+LINEAR_SPACE_THRESHOLD = int(os.environ.get("CORRECTOR_LINEAR_THRESHOLD", "200"))
+
+# Optional error budget as a fraction of the correct sentence length. Answers
+# further away than that are reported as "too different" without filling the
+# whole table. Unset means no budget.
+MAX_DISTANCE_RATIO = float(os.environ["CORRECTOR_MAX_DISTANCE_RATIO"]) if os.environ.get("CORRECTOR_MAX_DISTANCE_RATIO") else None
+
+
+def get_engine(name=None):
+    """Return the alignment function registered under ``name``."""
+    name = name or DEFAULT_ENGINE
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown alignment engine '{name}'. Available: {', '.join(sorted(ENGINES))}")
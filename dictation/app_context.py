@@ -1,14 +1,86 @@
-import json, os, random
+import json, logging, os, random
 from collections import defaultdict, OrderedDict
+from typing import NamedTuple, Optional, Tuple
+from .corrector import TargetProfile, strip_punct_and_space
+from .pinyin import build_syllable_index
+from .audio_index import AudioIndex
+from .snapshot import load_snapshot, save_snapshot
+
+# Rebuild the audio index this often (seconds) to pick up files added at runtime; unset = never
+AUDIO_REFRESH_SECONDS = float(os.environ["AUDIO_INDEX_REFRESH_SECONDS"]) if os.environ.get("AUDIO_INDEX_REFRESH_SECONDS") else None
+
+# Prebuilt content snapshot (see developer_tools/build_content_snapshot.py); empty = always load JSON
+SNAPSHOT_PATH = os.environ.get("CONTENT_SNAPSHOT_PATH", "content_snapshot.pickle")
+
+
+def parse_hsk_level(level):
+    """HSK level as an int, accepting both 3 and "HSK3"."""
+    if isinstance(level, str) and level.startswith("HSK"):
+        return int(level.replace("HSK", ""))
+    return int(level)
+
+
+class ConversationLine(NamedTuple):
+    """One conversation sentence as rendered by session_conversation.html"""
+    id: int
+    speaker: str
+    chinese: str
+    pinyin: str
+    english: str
+    audio_file: Optional[str]
+
+
+class ConversationPayload(NamedTuple):
+    """Everything the conversation templates need, built once per conversation"""
+    topic: str
+    hsk_level: int
+    sentences: Tuple[ConversationLine, ...]
+    audio_files: Tuple[str, ...]
+
 
 class DictationContext:
-    def __init__(self, json_path="sentences.json", audio_dir="static/audio_files", hsk_path="hsk_characters.json", stories_path="stories.json", conversations_path="conversations.json"):
-        self.sentences = self.load_sentences(json_path)
+    # Attributes that depend on the audio files rather than the content, rebuilt on every start
+    RUNTIME_STATE = ("content_paths", "audio_dir", "audio", "conversation_payloads", "payload_audio_version", "missing_audio")
+
+    def __init__(self, json_path="sentences.json", audio_dir="static/audio_files", hsk_path="hsk_characters.json", stories_path="stories.json", conversations_path="conversations.json", snapshot_path=SNAPSHOT_PATH):
+        self.content_paths = (json_path, hsk_path, stories_path, conversations_path)
         self.audio_dir = audio_dir
+        self.audio = AudioIndex(audio_dir, refresh_interval=AUDIO_REFRESH_SECONDS)
+        state = load_snapshot(snapshot_path, self.content_paths) if snapshot_path else None
+        if state is not None:
+            self.__dict__.update(state)
+        else:
+            self.load_content(*self.content_paths)
+        self.conversation_payloads = self.build_conversation_payloads()
+        # Report missing audio once at boot instead of on every request
+        self.missing_audio = self.find_missing_audio()
+        if self.missing_audio:
+            logging.warning(f"{len(self.missing_audio)} items have no audio file: {', '.join(self.missing_audio[:10])}"
+                            + (" ..." if len(self.missing_audio) > 10 else ""))
+
+    def load_content(self, json_path, hsk_path, stories_path, conversations_path):
+        """Parse the JSON content files and build every index derived from them"""
+        self.sentences = self.load_sentences(json_path)
+        self.partition_sentences()
         self.hsk_lookup = self.load_hsk(hsk_path)
+        # hanzi -> int HSK level, for character progress updates
+        self.hanzi_levels = {hanzi: parse_hsk_level(level) for hanzi, level in self.hsk_lookup.items()}
         self.hsk_totals = self.count_hanzi_per_hsk()
         self.stories = self.load_stories(stories_path)
         self.conversations = self.load_conversations(conversations_path)
+        self.index_story_parts()
+        self.index_conversations()
+        self.targets = self.compile_targets()
+        self.update_plans = self.compile_update_plans()
+        self.syllables = self.compile_syllables()
+
+    def snapshot_state(self):
+        """Content and derived indexes, as stored in the content snapshot"""
+        return {name: value for name, value in self.__dict__.items() if name not in self.RUNTIME_STATE}
+
+    def save_snapshot(self, path=None):
+        """Write the content snapshot loaded by later starts; returns its fingerprint"""
+        return save_snapshot(path or SNAPSHOT_PATH, self.content_paths, self.snapshot_state())
 
     def load_sentences(self, path):
         with open(path, "r", encoding="utf-8") as f:
@@ -36,6 +108,46 @@ class DictationContext:
         except FileNotFoundError:
             return {}
 
+    def compile_targets(self):
+        """Precompile the corrector's view of every sentence, story part and conversation line"""
+        items = list(self.sentences.values())
+        items += [part for story in self.stories.values() for part in story["parts"]]
+        items += [sent for conv in self.conversations.values() for sent in conv["sentences"]]
+        # Optional "alternatives": other accepted answers for the same audio
+        return {item["chinese"]: TargetProfile(item["chinese"], item.get("alternatives", ())) for item in items}
+
+    def plan_updates(self, target):
+        """
+        Character progress plan of a compiled sentence: (hanzi, hsk_level, positions)
+        for each distinct HSK character in order of appearance, ``positions``
+        being the bitmask of its indexes in the text without punctuation.
+        """
+        masks = {}
+        for k, ch in enumerate(target.stripped):
+            if ch in self.hanzi_levels:
+                masks[ch] = masks.get(ch, 0) | 1 << k
+        return tuple((ch, self.hanzi_levels[ch], mask) for ch, mask in masks.items())
+
+    def compile_update_plans(self):
+        """Precompute the character progress plan of every compiled sentence"""
+        return {text: self.plan_updates(target) for text, target in self.targets.items()}
+
+    def get_update_plan(self, text):
+        plan = self.update_plans.get(text)
+        return plan if plan is not None else self.plan_updates(self.get_target(text))
+
+    def compile_syllables(self):
+        """Hanzi to toneless pinyin syllable, read from the content's own pinyin fields"""
+        entries = [(s["chinese"], s.get("pinyin")) for s in self.sentences.values()]
+        entries += [(part["chinese"], part.get("pinyin")) for story in self.stories.values() for part in story["parts"]]
+        entries += [(sent["chinese"], sent.get("pinyin")) for conv in self.conversations.values() for sent in conv["sentences"]]
+        return build_syllable_index(entries, strip_punct_and_space)
+
+    def get_target(self, text):
+        """Compiled TargetProfile for a correct sentence (compiled on the fly if unknown)"""
+        target = self.targets.get(text)
+        return target if target is not None else TargetProfile(text)
+
     def get_sentence(self, sid):
         return self.sentences.get(sid)
 
@@ -45,99 +157,121 @@ class DictationContext:
     def get_conversation(self, conversation_id):
         return self.conversations.get(str(conversation_id))
 
+    def index_story_parts(self):
+        """Id-keyed parts and their positions, per story"""
+        self.story_parts = {}
+        self.story_part_positions = {}
+        for story_id, story in self.stories.items():
+            self.story_parts[story_id] = {part["id"]: part for part in story["parts"]}
+            self.story_part_positions[story_id] = {part["id"]: k for k, part in enumerate(story["parts"])}
+
+    def index_conversations(self):
+        """Id-keyed sentences and their positions per conversation, and conversations per category"""
+        self.conversation_sentences = {}
+        self.conversation_sentence_positions = {}
+        self.conversations_by_category = defaultdict(dict)
+        for conv_id, conversation in self.conversations.items():
+            self.conversation_sentences[conv_id] = {sent["id"]: sent for sent in conversation["sentences"]}
+            self.conversation_sentence_positions[conv_id] = {sent["id"]: k for k, sent in enumerate(conversation["sentences"])}
+            if "category" in conversation:
+                self.conversations_by_category[conversation["category"]][conv_id] = conversation
+        self.conversations_by_category = dict(self.conversations_by_category)
+        self.categories = tuple(sorted(self.conversations_by_category))
+
+    def build_conversation_payloads(self):
+        """Immutable render payload of every conversation, with its audio resolved"""
+        payloads = {}
+        for conv_id, conversation in self.conversations.items():
+            lines = tuple(
+                ConversationLine(sent["id"], sent["speaker"], sent["chinese"], sent.get("pinyin", ""),
+                                 sent.get("english", ""), self.conversation_audio_path(conv_id, sent["id"]))
+                for sent in conversation["sentences"]
+            )
+            audio_files = tuple(line.audio_file for line in lines if line.audio_file)
+            payloads[conv_id] = ConversationPayload(conversation["topic"], conversation["hsk_level"], lines, audio_files)
+        self.payload_audio_version = self.audio.version
+        return payloads
+
+    def get_conversation_payload(self, conversation_id):
+        """Shared render payload of a conversation (rebuilt if the audio index was refreshed), or None"""
+        self.audio.maybe_refresh()
+        if self.payload_audio_version != self.audio.version:
+            self.conversation_payloads = self.build_conversation_payloads()
+        return self.conversation_payloads.get(str(conversation_id))
+
+    def get_conversation_line(self, conversation_id, sentence_id):
+        """Rendered ConversationLine of a sentence, or None"""
+        payload = self.get_conversation_payload(conversation_id)
+        position = self.get_conversation_sentence_index(conversation_id, sentence_id)
+        return payload.sentences[position] if payload and position is not None else None
+
     def get_story_part(self, story_id, part_id):
-        story = self.get_story(story_id)
-        if story:
-            for part in story["parts"]:
-                if part["id"] == part_id:
-                    return part
-        return None
+        return self.story_parts.get(story_id, {}).get(part_id)
+
+    def get_story_part_index(self, story_id, part_id):
+        """Position of a part in its story, or None"""
+        return self.story_part_positions.get(story_id, {}).get(part_id)
 
     def get_conversation_sentence(self, conversation_id, sentence_id):
-        conversation = self.get_conversation(conversation_id)
-        if conversation:
-            for sentence in conversation["sentences"]:
-                if sentence["id"] == sentence_id:
-                    return sentence
-        return None
+        return self.conversation_sentences.get(str(conversation_id), {}).get(sentence_id)
+
+    def get_conversation_sentence_index(self, conversation_id, sentence_id):
+        """Position of a sentence in its conversation, or None"""
+        return self.conversation_sentence_positions.get(str(conversation_id), {}).get(sentence_id)
 
     def story_audio_path(self, story_id, part_id):
-        filename = f"story_{story_id}_{part_id}.mp3"
-        # Check new organized structure first
-        new_path = os.path.join(self.audio_dir, "stories", filename)
-        if os.path.exists(new_path):
-            return f"audio_files/stories/{filename}"
-        
-        # Fallback to old structure for backward compatibility
-        old_path = os.path.join(self.audio_dir, filename)
-        return f"audio_files/{filename}" if os.path.exists(old_path) else None
+        path = self.audio.resolve("stories", f"story_{story_id}_{part_id}.mp3")
+        return f"audio_files/{path}" if path else None
 
     def story_all_audio_paths(self, story_id):
         story = self.get_story(story_id)
         if not story:
             return []
-        audio_paths = []
-        for part in story["parts"]:
-            filename = f"story_{story_id}_{part['id']}.mp3"
-            # Check new organized structure first
-            new_path = os.path.join(self.audio_dir, "stories", filename)
-            if os.path.exists(new_path):
-                audio_paths.append(f"audio_files/stories/{filename}")
-            # Fallback to old structure
-            else:
-                old_path = os.path.join(self.audio_dir, filename)
-                if os.path.exists(old_path):
-                    audio_paths.append(f"audio_files/{filename}")
-        return audio_paths
+        paths = (self.story_audio_path(story_id, part["id"]) for part in story["parts"])
+        return [path for path in paths if path]
 
     def conversation_audio_path(self, conversation_id, sentence_id):
         filename = f"conv_{conversation_id}_{sentence_id}.mp3"
-        # Check new organized structure first
-        new_path = os.path.join(self.audio_dir, "conversations", filename)
-        if os.path.exists(new_path):
-            return filename
-        
-        # Fallback to old structure for backward compatibility
-        old_path = os.path.join(self.audio_dir, filename)
-        return filename if os.path.exists(old_path) else None
+        return filename if self.audio.resolve("conversations", filename) else None
 
     def conversation_all_audio_paths(self, conversation_id):
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
-            return []
-        audio_paths = []
-        for sentence in conversation["sentences"]:
-            filename = f"conv_{conversation_id}_{sentence['id']}.mp3"
-            # Check new organized structure first
-            new_path = os.path.join(self.audio_dir, "conversations", filename)
-            if os.path.exists(new_path):
-                audio_paths.append(filename)
-            # Fallback to old structure
-            else:
-                old_path = os.path.join(self.audio_dir, filename)
-                if os.path.exists(old_path):
-                    audio_paths.append(filename)
-        return audio_paths
+        payload = self.get_conversation_payload(conversation_id)
+        return payload.audio_files if payload else ()
 
     def audio_path(self, sid, hsk_level):
-        filename = f"{sid}_HSK{hsk_level}.mp3"
-        # Check new organized structure first
-        new_path = os.path.join(self.audio_dir, "hsk_characters", filename)
-        if os.path.exists(new_path):
-            return f"audio_files/hsk_characters/{filename}"
-        
-        # Fallback to old structure for backward compatibility
-        old_path = os.path.join(self.audio_dir, filename)
-        return f"audio_files/{filename}" if os.path.exists(old_path) else None
+        path = self.audio.resolve("hsk_characters", f"{sid}_HSK{hsk_level}.mp3")
+        return f"audio_files/{path}" if path else None
+
+    def find_missing_audio(self):
+        """Sentences, story parts and conversation lines without an audio file"""
+        missing = [f"sentence {sid}" for sid, s in self.sentences.items() if not self.audio_path(sid, s["hsk_level"])]
+        missing += [f"story {story_id} part {part['id']}" for story_id, story in self.stories.items()
+                    for part in story["parts"] if not self.story_audio_path(story_id, part["id"])]
+        missing += [f"conversation {conv_id} sentence {sent['id']}" for conv_id, conv in self.conversations.items()
+                    for sent in conv["sentences"] if not self.conversation_audio_path(conv_id, sent["id"])]
+        return missing
+
+    def partition_sentences(self):
+        """
+        Split the sentence ids by HSK level into immutable pools, once, so that
+        starting a session samples a prebuilt tuple instead of filtering every
+        sentence (O(count) per session however large the corpus is).
+        """
+        by_level = defaultdict(dict)
+        for sid, s in self.sentences.items():
+            by_level[parse_hsk_level(s["hsk_level"])][sid] = s
+        self.sentences_by_level = dict(by_level)
+        self.sentence_pools = {level: tuple(sentences) for level, sentences in by_level.items()}
+        self.all_sentence_ids = tuple(self.sentences)
 
     def get_random_ids(self, count=5, level=None):
-        sents = [sid for sid, s in self.sentences.items() if s["hsk_level"] == level] if level else list(self.sentences)
-        return random.sample(sents, min(count, len(sents)))
+        pool = self.sentence_pools.get(parse_hsk_level(level), ()) if level else self.all_sentence_ids
+        return random.sample(pool, min(count, len(pool)))
 
     def get_phrases_by_level(self, level=None):
-        """Get phrases/sentences filtered by HSK level"""
+        """Get phrases/sentences filtered by HSK level (shared dict, do not modify)"""
         if level:
-            return {sid: s for sid, s in self.sentences.items() if s["hsk_level"] == int(level)}
+            return self.sentences_by_level.get(parse_hsk_level(level), {})
         return self.sentences
 
     def count_hanzi_per_hsk(self):
@@ -149,18 +283,9 @@ class DictationContext:
         )
 
     def get_conversations_by_category(self, category):
-        """Get all conversations for a specific category"""
-        category_conversations = {}
-        for conv_id, conversation in self.conversations.items():
-            if conversation.get("category") == category:
-                category_conversations[conv_id] = conversation
-        return category_conversations
+        """Get all conversations for a specific category (shared dict, do not modify)"""
+        return self.conversations_by_category.get(category, {})
 
     def get_available_categories(self):
-        """Get all available conversation categories"""
-        categories = set()
-        for conversation in self.conversations.values():
-            if "category" in conversation:
-                categories.add(conversation["category"])
-        return sorted(list(categories))
-
+        """Get all available conversation categories, sorted"""
+        return self.categories
@@ -0,0 +1,96 @@
+"""
+In-memory index of the audio files available under static/audio_files.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+# Organised subdirectories; files may also sit directly in the audio directory (legacy layout)
+AUDIO_CATEGORIES = ("hsk_characters", "stories", "conversations")
+
+
+class AudioIndex:
+    """
+    Set of available audio files, built once so that resolving a path is a
+    lookup instead of ``os.path.exists`` calls on every request.
+
+    The index comes from a scan of ``audio_dir``; if the directory does not
+    exist (audio hosted elsewhere) it falls back to ``manifest.json`` written
+    by developer_tools/generate_audio_manifest.py. With ``refresh_interval``
+    (seconds) the index is rebuilt lazily on the first lookup after it has
+    expired, e.g. when audio files are added to a running deployment.
+    """
+
+    def __init__(self, audio_dir, refresh_interval=None, manifest_path=None):
+        self.audio_dir = audio_dir
+        self.refresh_interval = refresh_interval
+        self.manifest_path = manifest_path or os.path.join(audio_dir, "manifest.json")
+        self._lock = threading.Lock()
+        # Incremented on every rebuild, for data derived from the index
+        self.version = 0
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the index from the audio directory (or the manifest)."""
+        if os.path.isdir(self.audio_dir):
+            paths, source = self._scan(), "scan"
+        else:
+            paths, source = self._load_manifest(), "manifest"
+        with self._lock:
+            self.paths = paths
+            self.source = source
+            self.built_at = time.monotonic()
+            self.version += 1
+        logging.info(f"Audio index: {len(paths)} files from {source}")
+
+    def _scan(self):
+        paths = set()
+        with os.scandir(self.audio_dir) as entries:
+            paths.update(entry.name for entry in entries if entry.is_file())
+        for category in AUDIO_CATEGORIES:
+            directory = os.path.join(self.audio_dir, category)
+            if os.path.isdir(directory):
+                with os.scandir(directory) as entries:
+                    paths.update(f"{category}/{entry.name}" for entry in entries if entry.is_file())
+        return frozenset(paths)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logging.error(f"Audio index: no audio directory and no usable manifest ({e})")
+            return frozenset()
+        paths = {info["path"] for info in manifest.get("hsk_characters", {}).values()}
+        for category in ("stories", "conversations"):
+            for group in manifest.get(category, {}).values():
+                paths.update(info["path"] for info in group["files"].values())
+        return frozenset(paths)
+
+    def maybe_refresh(self):
+        """Rebuild the index if ``refresh_interval`` has elapsed since the last build."""
+        if self.refresh_interval and time.monotonic() - self.built_at > self.refresh_interval:
+            # Only one thread rebuilds; the others keep using the current index
+            if self._lock.acquire(blocking=False):
+                self.built_at = time.monotonic()
+                self._lock.release()
+                self.refresh()
+
+    def resolve(self, category, filename):
+        """
+        Path of an audio file relative to the audio directory, preferring the
+        organised ``category`` subdirectory over the legacy flat layout, or
+        None when the file does not exist.
+        """
+        self.maybe_refresh()
+        paths = self.paths
+        organised = f"{category}/{filename}"
+        if organised in paths:
+            return organised
+        return filename if filename in paths else None
+
+    def __len__(self):
+        return len(self.paths)
@@ -1,8 +1,257 @@
-import unicodedata, difflib
+import os
+import unicodedata
+from .alignment import get_engine, dp_align, linear_align, banded_align, trie_align, IncrementalAligner, VariantTrie, LINEAR_SPACE_THRESHOLD, MAX_DISTANCE_RATIO
+from .cache import LRUCache
+from .renderer import render_correction
+
+# Corrections shared by every Corrector in this worker process, keyed on the
+# correct sentence and the stripped user text (CORRECTION_CACHE_SIZE=0 disables it)
+correction_cache = LRUCache(int(os.environ.get("CORRECTION_CACHE_SIZE", "2048")))
+
+# Optional partial credit for homophones (在 typed for 再): a substitution by a
+# character with the same toneless pinyin syllable counts this much of a match
+PINYIN_TOLERANT = os.environ.get("CORRECTOR_PINYIN_TOLERANT", "").lower() in ("1", "true", "yes")
+HOMOPHONE_CREDIT = 0.5
+
+# As-you-type alignment state, one entry per browser session and sentence
+live_cache = LRUCache(int(os.environ.get("LIVE_CORRECTION_CACHE_SIZE", "512")))
+
+# Characters the corrector ignores: Unicode punctuation (categories P*) and
+# whitespace, CJK and ASCII alike. Planes 0-1 hold every punctuation code point
+# Unicode assigns, so scanning them once at import is enough.
+PUNCT_OR_SPACE = frozenset(
+    ch for ch in map(chr, range(0x20000))
+    if unicodedata.category(ch).startswith('P') or ch.isspace()
+)
+# str.translate deletion table: strips a whole string in one C-level pass
+STRIP_TABLE = dict.fromkeys(map(ord, PUNCT_OR_SPACE))
+
+
+def is_punct_or_space(ch):
+    return ch in PUNCT_OR_SPACE
+
+
+def strip_punct_and_space(text):
+    return text.translate(STRIP_TABLE)
+
+
+def live_input_limit(target):
+    """Longest stripped answer accepted for live correction of ``target``."""
+    return 2 * len(target.stripped) + 10
+
+
+class TargetProfile:
+    """
+    Everything compare() needs from a correct sentence, computed once.
+
+    ``stripped`` is the text without punctuation/whitespace, ``index_map`` the
+    position of each stripped character in ``text``, ``skeleton`` the runs of
+    punctuation around them (``skeleton[k]`` precedes stripped character k,
+    the last entry trails the sentence) and ``hanzi`` the set of characters.
+
+    ``alternatives`` are other accepted answers (traditional characters,
+    optional particles...), compiled with the sentence itself into one
+    ``variants`` trie so that they are all matched in a single pass. Each
+    alternative's ``main_positions`` maps its stripped positions to those of
+    the sentence it belongs to (None where it has no counterpart, e.g. an
+    optional particle); it is None on sentences that are not alternatives.
+    ``main_covered`` is the bitmask of the sentence's positions it maps to.
+    """
+    __slots__ = ("text", "stripped", "index_map", "skeleton", "hanzi", "alternatives", "variants", "main_positions", "main_covered")
+
+    def __init__(self, text, alternatives=()):
+        stripped = []
+        index_map = []
+        skeleton = []
+        run = ''
+        for idx, ch in enumerate(text):
+            if is_punct_or_space(ch):
+                run += ch
+            else:
+                stripped.append(ch)
+                index_map.append(idx)
+                skeleton.append(run)
+                run = ''
+        skeleton.append(run)
+        self.text = text
+        self.stripped = ''.join(stripped)
+        self.index_map = tuple(index_map)
+        self.skeleton = tuple(skeleton)
+        self.hanzi = frozenset(stripped)
+        self.alternatives = tuple(TargetProfile(alt) for alt in alternatives if alt and alt != text)
+        self.main_positions = None
+        self.main_covered = 0
+        self.variants = None
+        if self.alternatives:
+            self.variants = VariantTrie([self.stripped] + [alt.stripped for alt in self.alternatives])
+            for alt in self.alternatives:
+                # Pair characters kept (equal) or swapped (traditional form, replace) by the alternative
+                positions = [None] * len(alt.stripped)
+                for op, alt_idx, main_idx in dp_align(alt.stripped, self.stripped):
+                    if op in ('equal', 'replace'):
+                        positions[alt_idx] = main_idx
+                alt.main_positions = tuple(positions)
+                alt.main_covered = alt.main_mask((1 << len(alt.stripped)) - 1)
+
+    def main_mask(self, mask):
+        """Bitmask of stripped positions of this alternative moved onto its main sentence."""
+        main = 0
+        for k, position in enumerate(self.main_positions):
+            if position is not None and mask >> k & 1:
+                main |= 1 << position
+        return main
+
+    def __repr__(self):
+        return f"TargetProfile({self.text!r})"
+
+
+class Alignment:
+    """
+    Result of aligning a user answer with a TargetProfile.
+
+    ``ops`` holds one code per edit operation: ``e`` (equal), ``r`` (replace),
+    ``h`` (replace by a homophone, pinyin-tolerant mode only), ``i`` (missing
+    correct character) or ``d`` (extra user character); the string positions
+    are implied by the order. ``correct_mask`` has bit k set
+    when correct character k was typed correctly. The HTML is only rendered
+    when first needed.
+    """
+    __slots__ = ("target", "stripped_user", "ops", "correct_mask", "_html", "_correct_segments")
+
+    def __init__(self, target, stripped_user, ops):
+        self.target = target
+        self.stripped_user = stripped_user
+        self.ops = ops
+        mask = 0
+        c_idx = 0
+        for code in ops:
+            if code == 'e':
+                mask |= 1 << c_idx
+            if code != 'd':
+                c_idx += 1
+        self.correct_mask = mask
+        self._html = None
+        self._correct_segments = None
+
+    @property
+    def stripped_correct(self):
+        return self.target.stripped
+
+    @property
+    def correct_count(self):
+        return self.correct_mask.bit_count()
+
+    @property
+    def homophone_count(self):
+        return self.ops.count('h')
+
+    @property
+    def accuracy(self):
+        """
+        Percentage of correct characters typed correctly, rounded to an int.
+        Homophones count for HOMOPHONE_CREDIT of a character.
+        """
+        total = len(self.target.stripped)
+        score = self.correct_count + HOMOPHONE_CREDIT * self.homophone_count
+        return round(score / total * 100) if total else 0
+
+    def is_correct(self, position):
+        """Whether stripped correct character ``position`` was typed correctly."""
+        return bool(self.correct_mask >> position & 1)
+
+    @property
+    def correct_hanzi(self):
+        """Set of characters typed correctly at least once."""
+        return frozenset(self.correct_segments)
+
+    @property
+    def correct_segments(self):
+        """String of the correctly typed characters, in order."""
+        if self._correct_segments is None:
+            s_correct = self.target.stripped
+            self._correct_segments = ''.join(ch for k, ch in enumerate(s_correct) if self.correct_mask >> k & 1)
+        return self._correct_segments
+
+    def render(self, parts=None):
+        """Render (once) and return the correction HTML, optionally reusing ``parts``."""
+        if self._html is None:
+            self._html, self._correct_segments = render_correction(self.ops, self.stripped_user, self.target, parts)
+        return self._html
+
+    @property
+    def html(self):
+        return self.render()
+
+    def as_tuple(self):
+        """Legacy compare() result: (html, stripped_user, stripped_correct, correct_segments)."""
+        return self.html, self.stripped_user, self.target.stripped, self.correct_segments
+
 
 class Corrector:
+    def __init__(self, engine=None, linear_threshold=LINEAR_SPACE_THRESHOLD, max_distance_ratio=MAX_DISTANCE_RATIO, cache=correction_cache, live_cache=live_cache, syllables=None):
+        # Alignment backend, see dictation/alignment.py (CORRECTOR_ENGINE env var)
+        self.engine = get_engine(engine)
+        # Long inputs switch to the linear-space engine to bound per-request memory
+        self.linear_threshold = linear_threshold
+        # Error budget relative to the correct sentence length (None disables it)
+        self.max_distance_ratio = max_distance_ratio
+        self.cache = cache
+        self.live_cache = live_cache
+        # Hanzi -> toneless syllable (DictationContext.syllables); when given,
+        # same-syllable substitutions get partial credit
+        self.syllables = syllables
+
+    def max_distance(self, correct_length):
+        if self.max_distance_ratio is None:
+            return None
+        return max(1, int(self.max_distance_ratio * correct_length))
+
+    def edit_ops(self, s_user, s_correct, max_distance=None):
+        """
+        Return the edit operations between two stripped strings, or None when
+        ``max_distance`` is given and the strings are further apart than that.
+        """
+        long_input = max(len(s_user), len(s_correct)) > self.linear_threshold
+        if max_distance is None:
+            return linear_align(s_user, s_correct) if long_input else self.engine(s_user, s_correct)
+        if abs(len(s_user) - len(s_correct)) > max_distance:
+            return None
+        if not long_input:
+            return banded_align(s_user, s_correct, max_distance)
+        ops = linear_align(s_user, s_correct)
+        return ops if sum(op != 'equal' for op, _, _ in ops) <= max_distance else None
+
+    def edit_variant_ops(self, s_user, target, max_distance=None):
+        """
+        Pick the accepted answer closest to the user text among ``target`` and
+        its alternatives. Returns the chosen TargetProfile and its edit
+        operations (None when over ``max_distance``, the primary sentence's budget).
+        """
+        index, ops = trie_align(target.variants, s_user)
+        chosen = target.alternatives[index - 1] if index else target
+        long_input = max(len(s_user), len(chosen.stripped)) > self.linear_threshold
+        if max_distance is not None or long_input:
+            ops = self.edit_ops(s_user, chosen.stripped, max_distance)
+        return chosen, ops
+
+    def op_codes(self, ops, s_user, s_correct):
+        """One code per operation (see Alignment.ops), marking homophones if enabled."""
+        syllables = self.syllables
+        if not syllables:
+            return ''.join(op[0] for op, _, _ in ops)
+        codes = []
+        for op, u_idx, c_idx in ops:
+            if op == 'replace':
+                # One dict lookup per side: the index is built once at startup
+                syllable = syllables.get(s_correct[c_idx])
+                if syllable is not None and syllable == syllables.get(s_user[u_idx]):
+                    codes.append('h')
+                    continue
+            codes.append(op[0])
+        return ''.join(codes)
+
     def strip(self, text):
-        return ''.join(ch for ch in text if not unicodedata.category(ch).startswith('P') and not ch.isspace())
+        return strip_punct_and_space(text)
 
     def levenshtein(self, s1, s2):
         dp = [[0] * (len(s2) + 1) for _ in range(len(s1) + 1)]
@@ -14,93 +263,88 @@ class Corrector:
                 dp[i][j] = min(dp[i-1][j]+1, dp[i][j-1]+1, dp[i-1][j-1]+cost)
         return dp[-1][-1]
 
-    def compare(self, user_input, correct):
-        def is_punct_or_space(ch):
-            return unicodedata.category(ch).startswith('P') or ch.isspace()
-
-        def strip_and_map(text):
-            stripped = []
-            mapping = []
-            for idx, ch in enumerate(text):
-                if not is_punct_or_space(ch):
-                    stripped.append(ch)
-                    mapping.append(idx)
-            return ''.join(stripped), mapping
-
-        s_user, user_map = strip_and_map(user_input)
-        s_correct, correct_map = strip_and_map(correct)
-        n, m = len(s_user), len(s_correct)
-        # DP table for Levenshtein
-        dp = [[0] * (m+1) for _ in range(n+1)]
-        for i in range(n+1): dp[i][0] = i
-        for j in range(m+1): dp[0][j] = j
-        for i in range(1, n+1):
-            for j in range(1, m+1):
-                if s_user[i-1] == s_correct[j-1]:
-                    dp[i][j] = dp[i-1][j-1]
-                else:
-                    dp[i][j] = 1 + min(dp[i-1][j],    # deletion
-                                       dp[i][j-1],    # insertion
-                                       dp[i-1][j-1])  # substitution
-        # Backtrack to get alignment
-        i, j = n, m
-        ops = []
-        while i > 0 or j > 0:
-            if i > 0 and j > 0 and s_user[i-1] == s_correct[j-1]:
-                ops.append(('equal', i-1, j-1))
-                i -= 1
-                j -= 1
-            elif i > 0 and j > 0 and dp[i][j] == dp[i-1][j-1] + 1:
-                ops.append(('replace', i-1, j-1))
-                i -= 1
-                j -= 1
-            elif j > 0 and dp[i][j] == dp[i][j-1] + 1:
-                ops.append(('insert', None, j-1))
-                j -= 1
-            elif i > 0 and dp[i][j] == dp[i-1][j] + 1:
-                ops.append(('delete', i-1, None))
-                i -= 1
-        ops = ops[::-1]
-        # Build result with correct sentence's punctuation/space
-        result = ''
-        correct_segments = []
-        u_ptr = 0
-        c_ptr = 0
-        op_ptr = 0
-        # Map from stripped to original indices
-        while c_ptr < len(correct):
-            if is_punct_or_space(correct[c_ptr]):
-                result += correct[c_ptr]
-                c_ptr += 1
-                continue
-            # Find op for this char
-            if op_ptr < len(ops):
-                op, u_idx, c_idx = ops[op_ptr]
-                if c_idx is not None and correct_map[c_idx] != c_ptr:
-                    # This op is for a later char, so just output correct char
-                    result += correct[c_ptr]
-                    c_ptr += 1
-                    continue
-                if op == 'equal':
-                    result += f"<span class='diff-correct'>{user_input[user_map[u_idx]]}</span>"
-                    correct_segments.append(user_input[user_map[u_idx]])
-                    u_ptr = user_map[u_idx] + 1
-                    c_ptr += 1
-                elif op == 'replace':
-                    result += f"<span class='diff-del'>{user_input[user_map[u_idx]]}</span>"
-                    result += f"<span class='diff-ins'>{correct[c_ptr]}</span>"
-                    u_ptr = user_map[u_idx] + 1
-                    c_ptr += 1
-                elif op == 'insert':
-                    result += f"<span class='diff-ins'>{correct[c_ptr]}</span>"
-                    c_ptr += 1
-                elif op == 'delete':
-                    result += f"<span class='diff-extra'>{user_input[user_map[u_idx]]}</span>"
-                    u_ptr = user_map[u_idx] + 1
-                op_ptr += 1
-            else:
-                # No more ops, just output remaining correct chars
-                result += correct[c_ptr]
-                c_ptr += 1
-        return result, s_user, s_correct, ''.join(correct_segments)
+    def align(self, user_input, correct, max_distance=None):
+        """
+        Align a user answer with the correct sentence and return an Alignment.
+        ``correct`` is either the sentence text or its precompiled TargetProfile.
+        """
+        target = correct if isinstance(correct, TargetProfile) else TargetProfile(correct)
+        s_user = strip_punct_and_space(user_input)
+        if max_distance is None:
+            max_distance = self.max_distance(len(target.stripped))
+        # The result only depends on the user's non-punctuation characters
+        key = (target.text, s_user, max_distance, self.syllables is not None,
+               tuple(alt.text for alt in target.alternatives))
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if target.variants is not None:
+            target, ops = self.edit_variant_ops(s_user, target, max_distance)
+        else:
+            ops = self.edit_ops(s_user, target.stripped, max_distance)
+        if ops is None:
+            # Too different: show the whole sentence as the expected answer
+            codes = 'i' * len(target.stripped)
+        else:
+            codes = self.op_codes(ops, s_user, target.stripped)
+        alignment = Alignment(target, s_user, codes)
+        if self.cache is not None:
+            self.cache.put(key, alignment)
+        return alignment
+
+    def compare(self, user_input, correct, max_distance=None):
+        """
+        Compare a user answer with the correct sentence.
+
+        Returns:
+            Tuple of (html, stripped_user, stripped_correct, correct_segments)
+        """
+        return self.align(user_input, correct, max_distance).as_tuple()
+
+    def compare_many(self, pairs, max_distance=None):
+        """
+        Align several (user_input, correct) pairs at once, e.g. every line of
+        a conversation. Identical pairs are aligned once and the HTML buffer is
+        shared by all pairs.
+
+        Returns:
+            List of Alignment objects (HTML already rendered), in the order of ``pairs``.
+        """
+        alignments = []
+        seen = {}
+        parts = []
+        for user_input, correct in pairs:
+            key = (user_input, correct.text if isinstance(correct, TargetProfile) else correct)
+            alignment = seen.get(key)
+            if alignment is None:
+                alignment = seen[key] = self.align(user_input, correct, max_distance)
+                alignment.render(parts)
+            alignments.append(alignment)
+        return alignments
+
+    def align_prefix(self, user_input, correct, state_key=None):
+        """
+        Live correction of a partial answer: align what has been typed so far
+        with the part of the correct sentence it covers.
 
+        With a ``state_key`` (e.g. the browser session) the alignment table is
+        kept in ``live_cache`` and only extended by the characters typed since
+        the previous call. Input longer than ``live_input_limit`` is cut to it.
+        Returns an Alignment whose ops stop at the end of the covered prefix.
+        """
+        target = correct if isinstance(correct, TargetProfile) else TargetProfile(correct)
+        # Typing past the limit cannot improve the alignment, only grow the state
+        s_user = strip_punct_and_space(user_input)[:live_input_limit(target)]
+        aligner = None
+        if state_key is not None and self.live_cache is not None:
+            aligner = self.live_cache.get(state_key)
+            if aligner is None or aligner.s_correct != target.stripped:
+                aligner = IncrementalAligner(target.stripped)
+                self.live_cache.put(state_key, aligner)
+        if aligner is None:
+            aligner = IncrementalAligner(target.stripped)
+        with aligner.lock:
+            aligner.extend(s_user)
+            ops, _ = aligner.prefix_ops()
+        return Alignment(target, s_user, self.op_codes(ops, s_user, target.stripped))
@@ -2,7 +2,10 @@ import os
 import logging
 from datetime import date, timedelta
 from supabase import create_client
-from typing import Optional, Dict, Any, List
+from postgrest.exceptions import APIError
+from typing import Optional, Dict, Any, List, Tuple
+from .cache import TTLCache
+from .outbox import outbox
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
@@ -10,36 +13,60 @@ if SUPABASE_URL is None or SUPABASE_KEY is None:
     raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables.")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Today's session count per (user, date), shown in the header of every page. Writes from this
+# worker invalidate it; the TTL bounds how long a write from another worker goes unnoticed.
+DAILY_SESSION_COUNT_TTL = float(os.environ.get("DAILY_SESSION_COUNT_TTL", "60"))
+daily_session_counts = TTLCache(maxsize=4096, ttl=DAILY_SESSION_COUNT_TTL)
+
 def update_character_progress(user_id: str, hanzi: str, hsk_level: int, correct: bool) -> None:
     """
     Update the character progress for a user and hanzi, adjusting the grade field.
     """
     try:
-        result = supabase.table("character_progress").select("*") \
-            .eq("user_id", user_id).eq("hanzi", hanzi).execute()
-        if result.data:
-            progress = result.data[0]
-            prev_grade = progress.get("grade", -1)
-            if correct:
-                new_grade = min(prev_grade + 1, 3)
-            else:
-                new_grade = max(prev_grade - 1, -1)
-            supabase.table("character_progress").update({
-                "grade": new_grade,
-                "last_seen": "now()"
-            }).eq("user_id", user_id).eq("hanzi", hanzi).execute()
-        else:
-            supabase.table("character_progress").insert({
-                "user_id": user_id,
-                "hanzi": hanzi,
-                "hsk_level": hsk_level,
-                "grade": 0 if correct else -1,
-                "last_seen": "now()"
-            }).execute()
+        apply_character_progress(user_id, {hanzi: (hsk_level, [correct])})
     except Exception as e:
         logging.error(f"Error updating character progress for user {user_id}, hanzi {hanzi}: {e}")
 
 
+# Outbox keys remembered per row; far more than the writes a row can receive during one outage
+APPLIED_WRITES_KEPT = 20
+
+
+def applied_writes(row: Optional[Dict[str, Any]], write_key: Optional[str]) -> Dict[str, Any]:
+    """
+    applied_writes column of a row written by the outbox replayer: the keys of
+    the last APPLIED_WRITES_KEPT writes, stored in the same statement as the
+    write itself so that a replayed write can tell it was already applied.
+    """
+    if write_key is None:
+        return {}
+    previous = (row or {}).get("applied_writes") or []
+    return {"applied_writes": previous[-(APPLIED_WRITES_KEPT - 1):] + [write_key]}
+
+
+# PostgREST errors worth retrying: connection and timeout codes of PostgREST itself, and
+# SQLSTATE classes 08 (connection), 40 (rollback), 53 (resources), 57 (operator), 58 (system)
+TRANSIENT_POSTGREST_CODES = ("PGRST000", "PGRST001", "PGRST002", "PGRST003")
+TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57", "58")
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """
+    Whether a failed outbox write would fail again however often it is
+    retried: an error reported by PostgREST for the request itself (row level
+    security, constraint, unknown column...). Network errors and server-side
+    outages are transient.
+    """
+    if not isinstance(error, APIError) or not error.code:
+        return False
+    code = str(error.code)
+    if code.startswith("PGRST"):
+        return code not in TRANSIENT_POSTGREST_CODES
+    if code.isdigit() and len(code) == 3:
+        # HTTP status of a response without a PostgREST error body
+        return code.startswith("4") and code not in ("408", "429")
+    return code[:2] not in TRANSIENT_SQLSTATE_CLASSES
+
 
 def update_daily_work_registry(
     user_id: str,
@@ -51,89 +78,128 @@ def update_daily_work_registry(
 ) -> None:
     """
     Update daily work registry for a user with session average accuracy.
+    With the outbox enabled the write is recorded locally and applied by its replayer.
     """
+    write = {
+        "user_id": user_id,
+        "session_date": date.today().isoformat(),
+        "session_type": session_type,
+        "sentences_above_7": 1 if average_accuracy >= 7 else 0,
+        "total_sentences": total_sentences,
+        "story_id": story_id,
+        "story_parts_completed": story_parts_completed
+    }
     try:
-        today = date.today().isoformat()
-        sentences_above_7 = 1 if average_accuracy >= 7 else 0
-        result = supabase.table("daily_work_registry").select("*") \
-            .eq("user_id", user_id) \
-            .eq("session_date", today) \
-            .eq("session_type", session_type) \
-            .eq("story_id", story_id or "NULL") \
-            .execute()
-        if result.data:
-            existing = result.data[0]
-            new_sentences_above_7 = existing["sentences_above_7"] + sentences_above_7
-            new_total_sentences = existing["total_sentences"] + total_sentences
-            new_story_parts_completed = existing["story_parts_completed"] + story_parts_completed
-            supabase.table("daily_work_registry").update({
-                "sentences_above_7": new_sentences_above_7,
-                "total_sentences": new_total_sentences,
-                "story_parts_completed": new_story_parts_completed
-            }).eq("id", existing["id"]).execute()
+        if outbox:
+            outbox.record("daily_work", write)
         else:
-            supabase.table("daily_work_registry").insert({
-                "user_id": user_id,
-                "session_date": today,
-                "session_type": session_type,
-                "sentences_above_7": sentences_above_7,
-                "total_sentences": total_sentences,
-                "story_id": story_id,
-                "story_parts_completed": story_parts_completed
-            }).execute()
+            apply_daily_work(write)
     except Exception as e:
         logging.error(f"Error updating daily work registry for user {user_id}: {e}")
 
+
+def apply_daily_work(write: Dict[str, Any], write_key: Optional[str] = None) -> None:
+    """
+    Add a session's counts to the user's daily_work_registry row for its date
+    and type. Raises on Supabase errors. A write_key already applied is skipped.
+    """
+    if write_key:
+        # Practice rows (story_id NULL) are never matched below and always inserted,
+        # so look the key up across the user's rows of that day
+        applied = supabase.table("daily_work_registry").select("id") \
+            .eq("user_id", write["user_id"]) \
+            .eq("session_date", write["session_date"]) \
+            .contains("applied_writes", [write_key]) \
+            .execute()
+        if applied.data:
+            return
+    result = supabase.table("daily_work_registry").select("*") \
+        .eq("user_id", write["user_id"]) \
+        .eq("session_date", write["session_date"]) \
+        .eq("session_type", write["session_type"]) \
+        .eq("story_id", write["story_id"] or "NULL") \
+        .execute()
+    if result.data:
+        existing = result.data[0]
+        supabase.table("daily_work_registry").update({
+            "sentences_above_7": existing["sentences_above_7"] + write["sentences_above_7"],
+            "total_sentences": existing["total_sentences"] + write["total_sentences"],
+            "story_parts_completed": existing["story_parts_completed"] + write["story_parts_completed"],
+            **applied_writes(existing, write_key)
+        }).eq("id", existing["id"]).execute()
+    else:
+        supabase.table("daily_work_registry").insert({**write, **applied_writes(None, write_key)}).execute()
+    daily_session_counts.invalidate((write["user_id"], write["session_date"]))
+
+# Days of daily_work_registry fetched per query; longer streaks fetch the preceding window
+STATS_WINDOW_DAYS = 90
+# Rows per request; PostgREST never returns more than its max-rows setting (1000 on Supabase)
+STATS_PAGE_SIZE = 1000
+
+
+def fetch_daily_totals(user_id: str, start: date, end: date) -> Dict[date, Dict[str, int]]:
+    """
+    Per-day sentences_above_7 and total_sentences of a user between start and
+    end (inclusive), summed over session types. A single query unless the
+    range holds more than STATS_PAGE_SIZE rows (every practice session is its
+    own row), then read page by page, newest first.
+    """
+    totals: Dict[date, Dict[str, int]] = {}
+    offset = 0
+    while True:
+        result = supabase.table("daily_work_registry") \
+            .select("session_date, sentences_above_7, total_sentences") \
+            .eq("user_id", user_id) \
+            .gte("session_date", start.isoformat()) \
+            .lte("session_date", end.isoformat()) \
+            .order("session_date", desc=True) \
+            .order("id") \
+            .range(offset, offset + STATS_PAGE_SIZE - 1) \
+            .execute()
+        records = result.data or []
+        for record in records:
+            day = totals.setdefault(date.fromisoformat(record["session_date"]), {"sentences_above_7": 0, "total_sentences": 0})
+            day["sentences_above_7"] += record["sentences_above_7"]
+            day["total_sentences"] += record["total_sentences"]
+        if len(records) < STATS_PAGE_SIZE:
+            return totals
+        offset += STATS_PAGE_SIZE
+
+
 def get_daily_work_stats(user_id: str) -> Dict[str, Any]:
     """
     Get daily work statistics for dashboard.
+    Today's totals, the streak and the last 7 days come from one date-range
+    query; only a streak longer than STATS_WINDOW_DAYS needs more.
     """
     try:
         today = date.today()
-        today_result = supabase.table("daily_work_registry").select("*") \
-            .eq("user_id", user_id) \
-            .eq("session_date", today.isoformat()) \
-            .execute()
-        today_sentences_above_7 = 0
-        today_total_sentences = 0
-        for record in today_result.data:
-            today_sentences_above_7 += record["sentences_above_7"]
-            today_total_sentences += record["total_sentences"]
+        start = today - timedelta(days=STATS_WINDOW_DAYS - 1)
+        totals = fetch_daily_totals(user_id, start, today)
+        empty = {"sentences_above_7": 0, "total_sentences": 0}
+        today_totals = totals.get(today, empty)
         current_streak = 0
         check_date = today
-        while True:
-            date_str = check_date.isoformat()
-            result = supabase.table("daily_work_registry").select("*") \
-                .eq("user_id", user_id) \
-                .eq("session_date", date_str) \
-                .execute()
-            if not result.data:
-                break
-            has_above_7 = any(record["sentences_above_7"] > 0 for record in result.data)
-            if has_above_7:
-                current_streak += 1
-                check_date -= timedelta(days=1)
-            else:
-                break
+        while totals.get(check_date, empty)["sentences_above_7"] > 0:
+            current_streak += 1
+            check_date -= timedelta(days=1)
+            if check_date < start:
+                # The streak spans the whole window: fetch the one before it
+                start = check_date - timedelta(days=STATS_WINDOW_DAYS - 1)
+                totals.update(fetch_daily_totals(user_id, start, check_date))
         last_7_days: List[Dict[str, Any]] = []
         for i in range(6, -1, -1):
             check_date = today - timedelta(days=i)
-            date_str = check_date.isoformat()
-            result = supabase.table("daily_work_registry").select("*") \
-                .eq("user_id", user_id) \
-                .eq("session_date", date_str) \
-                .execute()
-            day_sentences_above_7 = sum(record["sentences_above_7"] for record in result.data)
-            day_total_sentences = sum(record["total_sentences"] for record in result.data)
+            day = totals.get(check_date, empty)
             last_7_days.append({
                 "date": check_date.strftime("%a"),
-                "sentences_above_7": day_sentences_above_7,
-                "total_sentences": day_total_sentences,
-                "completed": day_sentences_above_7 > 0
+                "sentences_above_7": day["sentences_above_7"],
+                "total_sentences": day["total_sentences"],
+                "completed": day["sentences_above_7"] > 0
             })
         return {
-            "today_sentences_above_7": today_sentences_above_7,
-            "today_total_sentences": today_total_sentences,
+            "today_sentences_above_7": today_totals["sentences_above_7"],
+            "today_total_sentences": today_totals["total_sentences"],
             "current_streak": current_streak,
             "last_7_days": last_7_days
         }
@@ -150,48 +216,118 @@ def get_daily_session_count(user_id: str) -> int:
     """
     Returns the number of daily sessions completed today for the user.
     A session is a row in daily_work_registry for today and user_id, regardless of session_type.
+    Cached for DAILY_SESSION_COUNT_TTL seconds.
     """
     try:
         today = date.today().isoformat()
+        count = daily_session_counts.get((user_id, today))
+        if count is not None:
+            return count
         result = supabase.table("daily_work_registry").select("id").eq("user_id", user_id).eq("session_date", today).execute()
-        return len(result.data) if result.data else 0
+        count = len(result.data) if result.data else 0
+        daily_session_counts.put((user_id, today), count)
+        return count
     except Exception as e:
         logging.error(f"Error getting daily session count for user {user_id}: {e}")
         return 0
 
+def next_grade(prev_grade: Optional[int], correct: bool) -> int:
+    """
+    Grade of a character after one answer. Unseen characters (prev_grade None)
+    start at 0 if correct, -1 otherwise.
+    """
+    if prev_grade is None:
+        return 0 if correct else -1
+    if correct:
+        return min(prev_grade + 1, 3)
+    return max(prev_grade - 1, 0)
+
+
+# False once Supabase reports apply_character_answers missing (create_apply_character_answers.sql not run yet)
+grade_function_available = True
+
+
+def apply_character_progress(user_id: str, answers: Dict[str, Tuple[int, List[bool]]], write_key: Optional[str] = None) -> None:
+    """
+    Apply answers to a user's character progress in one round trip: the
+    apply_character_answers Postgres function (developer_tools/
+    create_apply_character_answers.sql) moves each grade inside an upsert, so
+    concurrent submissions cannot lose updates. answers maps each hanzi to
+    (hsk_level, [correct, ...]), its answers in the order they were given.
+    Rows that already applied write_key are left unchanged. Raises on
+    Supabase errors.
+    """
+    global grade_function_available
+    if grade_function_available:
+        batch = [{"hanzi": hanzi, "hsk_level": hsk_level, "correct": correct}
+                 for hanzi, (hsk_level, outcomes) in answers.items() for correct in outcomes]
+        try:
+            supabase.rpc("apply_character_answers", {
+                "p_user_id": user_id,
+                "p_answers": batch,
+                "p_write_key": write_key
+            }).execute()
+            return
+        except APIError as e:
+            # PGRST202: no such function
+            if e.code != "PGRST202":
+                raise
+            grade_function_available = False
+            logging.warning("apply_character_answers is not deployed, computing grades in Python "
+                            "(run developer_tools/create_apply_character_answers.sql)")
+    read_modify_write_character_progress(user_id, answers, write_key)
+
+
+def read_modify_write_character_progress(user_id: str, answers: Dict[str, Tuple[int, List[bool]]], write_key: Optional[str] = None) -> None:
+    """
+    apply_character_progress without the Postgres function: one SELECT and one
+    UPSERT, the grades computed in between with next_grade.
+    """
+    columns = "hanzi, grade, applied_writes" if write_key else "hanzi, grade"
+    result = supabase.table("character_progress").select(columns).eq("user_id", user_id).in_("hanzi", list(answers)).execute()
+    current = {row["hanzi"]: row for row in (result.data or [])}
+    upserts = []
+    for hanzi, (hsk_level, outcomes) in answers.items():
+        row = current.get(hanzi)
+        if write_key and row and write_key in (row.get("applied_writes") or []):
+            continue
+        grade = row.get("grade", -1) if row else None
+        for correct in outcomes:
+            grade = next_grade(grade, correct)
+        upserts.append({
+            "user_id": user_id,
+            "hanzi": hanzi,
+            "hsk_level": hsk_level,
+            "grade": grade,
+            "last_seen": "now()",
+            **applied_writes(row, write_key)
+        })
+    if upserts:
+        supabase.table("character_progress").upsert(upserts, on_conflict="user_id,hanzi").execute()
+
+
+def write_character_progress(user_id: str, answers: Dict[str, Tuple[int, List[bool]]]) -> None:
+    """Apply answers now, or record them in the outbox when it is enabled. Raises on errors."""
+    if outbox:
+        outbox.record("character_progress", {"user_id": user_id, "answers": answers})
+    else:
+        apply_character_progress(user_id, answers)
+
+
 def batch_update_character_progress(user_id: str, hanzi_updates: list) -> None:
     """
     Batch update character progress for a user. hanzi_updates is a list of dicts:
     {"hanzi": ..., "hsk_level": ..., "correct": ...}
+    Scored answers go through progress_queue.ProgressWriteQueue instead, which
+    calls write_character_progress from a background thread.
     """
     try:
-        hanzi_list = [u["hanzi"] for u in hanzi_updates]
-        # Fetch current progress for all hanzi in one query
-        result = supabase.table("character_progress").select("hanzi, grade").eq("user_id", user_id).in_("hanzi", hanzi_list).execute()
-        current = {row["hanzi"]: row for row in (result.data or [])}
-        upserts = []
+        answers: Dict[str, Tuple[int, List[bool]]] = {}
         for update in hanzi_updates:
-            hanzi = update["hanzi"]
-            hsk_level = update["hsk_level"]
-            correct = update["correct"]
-            prev = current.get(hanzi)
-            if prev:
-                prev_grade = prev.get("grade", -1)
-                if correct:
-                    new_grade = min(prev_grade + 1, 3)
-                else:
-                    new_grade = max(prev_grade - 1, 0)
-            else:
-                new_grade = 0 if correct else -1
-            upserts.append({
-                "user_id": user_id,
-                "hanzi": hanzi,
-                "hsk_level": hsk_level,
-                "grade": new_grade,
-                "last_seen": "now()"
-            })
-        if upserts:
-            supabase.table("character_progress").upsert(upserts, on_conflict="user_id,hanzi").execute()
+            hsk_level, outcomes = answers.setdefault(update["hanzi"], (update["hsk_level"], []))
+            outcomes.append(update["correct"])
+        if answers:
+            write_character_progress(user_id, answers)
     except Exception as e:
         logging.error(f"Error batch updating character progress for user {user_id}: {e}")
 
@@ -242,4 +378,9 @@ def get_user_progress_summary(user_id: str, ctx) -> List[Dict[str, Any]]:
         return levels
     except Exception as e:
         logging.error("Error loading progress from Supabase:", e)
-        return [] 
\ No newline at end of file
+        return [] 
+
+if outbox:
+    outbox.register("daily_work", apply_daily_work, is_permanent_error)
+    outbox.register("character_progress", lambda write, key: apply_character_progress(write["user_id"], write["answers"], key),
+                    is_permanent_error)
@@ -11,9 +11,14 @@ from .corrector import Corrector
 class FormHandler:
     """Base class for form handling across different session types."""
     
-    def __init__(self, corrector: Corrector):
+    def __init__(self, corrector: Corrector, ctx=None):
         self.corrector = corrector
+        self.ctx = ctx
     
+    def _target(self, correct_text: str):
+        """Precompiled target for the corrector when a DictationContext is available."""
+        return self.ctx.get_target(correct_text) if self.ctx else correct_text
+
     def validate_user_input(self, user_input: str) -> Tuple[bool, str]:
         """
         Validate user input and return (is_valid, error_message).
@@ -52,16 +57,12 @@ class FormHandler:
                 "user_input": user_input
             }
         
-        correction, stripped_user, stripped_correct, correct_segments = self.corrector.compare(
-            user_input.strip(), correct_text
-        )
-        
-        accuracy = round(len(correct_segments) / len(stripped_correct) * 100) if len(stripped_correct) > 0 else 0
+        alignment = self.corrector.align(user_input.strip(), self._target(correct_text))
         
         return {
-            "correction": correction,
-            "accuracy": accuracy,
-            "correct_segments": correct_segments,
+            "correction": alignment.html,
+            "accuracy": alignment.accuracy,
+            "correct_segments": alignment.correct_segments,
             "user_input": user_input.strip()
         }
 
@@ -224,23 +225,28 @@ class ConversationFormHandler(FormHandler):
         all_corrections = []
         total_accuracy = 0
         total_sentences = len(conversation["sentences"])
-        
-        for sentence in conversation["sentences"]:
-            sentence_id = str(sentence["id"])
-            user_input = user_inputs.get(sentence_id, "")
-            
-            # Process each sentence
-            result = self.process_single_input(user_input, sentence["chinese"])
-            total_accuracy += result["accuracy"]
+        answers = [user_inputs.get(str(sentence["id"]), "") for sentence in conversation["sentences"]]
+        
+        # Align every answered sentence in one batch; blank answers score 0 like process_single_input
+        alignments = iter(self.corrector.compare_many([
+            (user_input.strip(), self._target(sentence["chinese"]))
+            for sentence, user_input in zip(conversation["sentences"], answers)
+            if user_input.strip()
+        ]))
+        
+        for sentence, user_input in zip(conversation["sentences"], answers):
+            alignment = next(alignments) if user_input.strip() else None
+            accuracy = alignment.accuracy if alignment else 0
+            total_accuracy += accuracy
             
             all_corrections.append({
-                "sentence_id": sentence_id,
+                "sentence_id": str(sentence["id"]),
                 "chinese": sentence["chinese"],
                 "user_input": user_input,
-                "correction": result["correction"],
+                "correction": alignment.html if alignment else "",
                 "pinyin": sentence["pinyin"],
                 "translation": sentence["english"],
-                "accuracy": result["accuracy"],
+                "accuracy": accuracy,
                 "speaker": sentence["speaker"]
             })
         
@@ -0,0 +1,309 @@
+"""
+Durable local outbox for progress writes, replayed to Supabase in order.
+"""
+
+import atexit
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+# SQLite file of the outbox; unset = progress is written to Supabase directly
+OUTBOX_PATH = os.environ.get("PROGRESS_OUTBOX_PATH")
+# Failed attempts after which an entry is moved to the dead-letter table
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("PROGRESS_OUTBOX_MAX_ATTEMPTS", "50"))
+
+SCHEMA = """
+create table if not exists outbox (
+    id integer primary key autoincrement,
+    key text not null unique,
+    kind text not null,
+    payload text not null,
+    created_at real not null,
+    attempts integer not null default 0,
+    next_attempt real not null,
+    last_error text
+);
+create table if not exists outbox_dead (
+    id integer primary key autoincrement,
+    key text not null unique,
+    kind text not null,
+    payload text not null,
+    created_at real not null,
+    attempts integer not null,
+    failed_at real not null,
+    last_error text
+);
+create table if not exists replayer_lease (
+    name text primary key,
+    owner text not null,
+    expires_at real not null
+);
+"""
+
+
+class Outbox:
+    """
+    Progress writes recorded in a local SQLite file by the request (a single
+    INSERT, no network), then applied to Supabase by a background replayer.
+
+    Entries are applied one at a time in the order they were recorded, by the
+    handler registered for their kind, ``handler(payload, key)``. A failure
+    stops the pass and the entry is retried with exponential backoff, so an
+    outage neither loses writes nor reorders them. Handlers must be
+    idempotent for their ``key``: an entry whose write reached Supabase but
+    whose response was lost is applied again.
+
+    All workers share the file. Only the holder of a lease replays, so that
+    entries are never applied concurrently; the lease expires if its worker
+    dies and another takes over.
+
+    An entry that can never be applied must not hold back the ones behind it:
+    entries of an unregistered kind, failures the handler's ``is_permanent``
+    recognises (e.g. a constraint violation) and entries still failing after
+    ``max_attempts`` are moved to the ``outbox_dead`` table, where they are
+    kept for inspection and can be put back with ``requeue_dead``.
+    """
+
+    def __init__(self, path: str, base_delay: float = 1.0, max_delay: float = 300.0,
+                 lease_seconds: float = 60.0, poll_interval: float = 1.0,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.handlers: Dict[str, Callable[[Any, str], None]] = {}
+        self.permanent: Dict[str, Callable[[Exception], bool]] = {}
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._owner = None
+        self._stopping = False
+        self.recorded = 0
+        self.applied = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def register(self, kind: str, handler: Callable[[Any, str], None],
+                 is_permanent: Optional[Callable[[Exception], bool]] = None) -> None:
+        """
+        Apply entries of ``kind`` with ``handler(payload, key)``. Errors for
+        which ``is_permanent(error)`` is true are not retried.
+        """
+        self.handlers[kind] = handler
+        if is_permanent is not None:
+            self.permanent[kind] = is_permanent
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process, opened on first use: never in the
+        # gunicorn master (preload_app), whose connections the workers would inherit
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def record(self, kind: str, payload: Any) -> str:
+        """Store a write for replay and wake the replayer; returns its key."""
+        key = uuid.uuid4().hex
+        now = time.time()
+        self._connection().execute(
+            "insert into outbox (key, kind, payload, created_at, next_attempt) values (?, ?, ?, ?, ?)",
+            (key, kind, json.dumps(payload), now, now))
+        self.recorded += 1
+        self._ensure_thread()
+        self._wake.set()
+        return key
+
+    def start(self) -> bool:
+        """
+        Start the replayer if entries are pending, e.g. left by a previous
+        deploy or a worker that died; called when a worker boots. Returns
+        whether it was started.
+        """
+        pending, = self._connection().execute("select count(*) from outbox").fetchone()
+        if pending:
+            self._ensure_thread()
+            self._wake.set()
+        return pending > 0
+
+    def _ensure_thread(self) -> None:
+        pid = os.getpid()
+        if self._stopping or (self._thread is not None and self._pid == pid):
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != pid:
+                self._pid = pid
+                self._owner = f"{pid}-{uuid.uuid4().hex[:8]}"
+                self._thread = threading.Thread(target=self._run, name="progress-outbox", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            try:
+                self.replay()
+            except Exception as e:
+                logging.error(f"Outbox replay failed: {e}")
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+
+    def _next_wait(self) -> float:
+        row = self._connection().execute("select min(next_attempt) from outbox").fetchone()
+        if row[0] is None:
+            return self.poll_interval
+        return min(max(row[0] - time.time(), 0.05), self.poll_interval)
+
+    def _acquire_lease(self) -> bool:
+        if self._owner is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._owner = f"{self._pid}-{uuid.uuid4().hex[:8]}"
+        conn = self._connection()
+        now = time.time()
+        conn.execute("begin immediate")
+        try:
+            row = conn.execute("select owner, expires_at from replayer_lease where name = 'replayer'").fetchone()
+            if row is not None and row[0] != self._owner and row[1] > now:
+                return False
+            conn.execute("insert or replace into replayer_lease (name, owner, expires_at) values ('replayer', ?, ?)",
+                         (self._owner, now + self.lease_seconds))
+            return True
+        finally:
+            conn.execute("commit")
+
+    def replay(self) -> int:
+        """
+        Apply the due entries in order, stopping at the first failure or at an
+        entry still backing off. Returns the number of entries applied.
+        """
+        with self._replay_lock:
+            return self._replay()
+
+    def _replay(self) -> int:
+        if not self._acquire_lease():
+            return 0
+        conn = self._connection()
+        applied = 0
+        while True:
+            row = conn.execute("select id, key, kind, payload, attempts, next_attempt from outbox order by id limit 1").fetchone()
+            if row is None or row[5] > time.time():
+                break
+            entry_id, key, kind, payload, attempts, _ = row
+            handler = self.handlers.get(kind)
+            try:
+                if handler is None:
+                    raise LookupError(f"no handler registered for {kind!r}")
+                handler(json.loads(payload), key)
+            except Exception as e:
+                attempts += 1
+                error = f"{type(e).__name__}: {e}"
+                self.failures += 1
+                self.last_error = error
+                is_permanent = self.permanent.get(kind)
+                if handler is None or attempts >= self.max_attempts or (is_permanent is not None and is_permanent(e)):
+                    self._bury(entry_id, attempts, error)
+                    logging.error(f"Outbox: {kind} write {key} failed (attempt {attempts}), moved to outbox_dead: {e}")
+                    continue
+                delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay) * random.uniform(0.8, 1.2)
+                conn.execute("update outbox set attempts = ?, next_attempt = ?, last_error = ? where id = ?",
+                             (attempts, time.time() + delay, error, entry_id))
+                logging.error(f"Outbox: {kind} write {key} failed (attempt {attempts}, retrying in {delay:.0f}s): {e}")
+                break
+            conn.execute("delete from outbox where id = ?", (entry_id,))
+            self.applied += 1
+            applied += 1
+            if not self._acquire_lease():
+                break
+        return applied
+
+    def flush(self, user_id: Optional[str] = None, timeout: float = 2.0) -> bool:
+        """
+        Apply the entries recorded so far, or those up to the last one whose
+        payload has this ``user_id``, before reading what they write. Replays
+        here when this worker can take the lease, otherwise waits for the
+        worker holding it. Gives up after ``timeout`` seconds or when an entry
+        is backing off (Supabase unreachable); returns whether they were applied.
+        """
+        conn = self._connection()
+        if user_id is None:
+            last, = conn.execute("select max(id) from outbox").fetchone()
+        else:
+            last, = conn.execute("select max(id) from outbox where json_extract(payload, '$.user_id') = ?",
+                                 (user_id,)).fetchone()
+        if last is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            self.replay()
+            row = conn.execute("select next_attempt from outbox where id <= ? order by id limit 1", (last,)).fetchone()
+            if row is None:
+                return True
+            if row[0] > time.time() or time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def _bury(self, entry_id: int, attempts: int, error: str) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute("begin")
+            conn.execute("insert into outbox_dead (key, kind, payload, created_at, attempts, failed_at, last_error) "
+                         "select key, kind, payload, created_at, ?, ?, ? from outbox where id = ?",
+                         (attempts, time.time(), error, entry_id))
+            conn.execute("delete from outbox where id = ?", (entry_id,))
+
+    def requeue_dead(self) -> int:
+        """Put the dead-letter entries back at the end of the outbox (e.g. after a fix); returns their number."""
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute("begin")
+            moved = conn.execute("insert into outbox (key, kind, payload, created_at, next_attempt) "
+                                 "select key, kind, payload, created_at, ? from outbox_dead order by id", (now,)).rowcount
+            conn.execute("delete from outbox_dead")
+        self._ensure_thread()
+        self._wake.set()
+        return moved
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the replayer (pending entries stay in the file for the next worker)."""
+        self._stopping = True
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread is not threading.current_thread():
+            thread.join(timeout)
+        if self._owner is not None:
+            self._connection().execute("delete from replayer_lease where owner = ?", (self._owner,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Pending and dead-letter entries, age of the oldest pending one and counters, e.g. for the health endpoint."""
+        conn = self._connection()
+        pending, oldest = conn.execute("select count(*), min(created_at) from outbox").fetchone()
+        dead, = conn.execute("select count(*) from outbox_dead").fetchone()
+        return {
+            "pending": pending,
+            "dead": dead,
+            "oldest_seconds": round(time.time() - oldest, 1) if oldest else 0,
+            "recorded": self.recorded,
+            "applied": self.applied,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+outbox = Outbox(OUTBOX_PATH) if OUTBOX_PATH else None
+if outbox:
+    # Development server and scripts; gunicorn workers stop it from the worker_exit hook
+    atexit.register(outbox.stop)
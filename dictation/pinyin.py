@@ -0,0 +1,80 @@
+"""
+Hanzi to pinyin syllable lookup built from the pinyin fields of the content.
+"""
+
+import re
+import sys
+import unicodedata
+from collections import Counter, defaultdict
+
+# Tone diacritics (macron, acute, caron, grave); the diaeresis of ü is kept
+TONE_MARKS = dict.fromkeys(map(ord, "̄́̌̀"))
+
+# Any initial followed by any final. Also accepts a few combinations that do
+# not exist, which is harmless: they never occur in the content.
+SYLLABLE = re.compile(
+    r"(?:zh|ch|sh|[bpmfdtnlgkhjqxrzcsyw])?"
+    r"(?:iang|iong|uang|ueng|ang|eng|ing|ong|uai|uan|van|ian|iao|"
+    r"ai|ei|ao|ou|an|en|in|un|vn|ia|ie|iu|ua|uo|ui|ve|ue|er|a|o|e|i|u|v)"
+)
+VOWELS = frozenset("aoe")
+
+
+def toneless(pinyin):
+    """Lowercase pinyin without tone marks, ``ü`` written as ``v``."""
+    text = unicodedata.normalize("NFD", pinyin.lower()).translate(TONE_MARKS)
+    return unicodedata.normalize("NFC", text).replace("ü", "v")
+
+
+def _segment(word, start=0):
+    """
+    Split one pinyin word into syllables, or return None.
+
+    Written pinyin puts an apostrophe before a syllable starting with a, o or
+    e (xī'ān), so inside a word every syllable after the first starts with a
+    consonant; this settles splits such as dàngāo (dan|gao, not dang|ao). A
+    trailing ``r`` is the erhua 儿.
+    """
+    if start == len(word):
+        return []
+    if word[start:] == "r" and start > 0:
+        return ["er"]
+    if start > 0 and word[start] in VOWELS:
+        return None
+    for end in range(min(len(word), start + 6), start, -1):
+        if SYLLABLE.fullmatch(word, start, end):
+            rest = _segment(word, end)
+            if rest is not None:
+                return [word[start:end]] + rest
+    return None
+
+
+def split_syllables(pinyin):
+    """Toneless syllables of a pinyin text, or None if it cannot be segmented."""
+    syllables = []
+    for word in re.findall(r"[a-zv]+", toneless(pinyin)):
+        segmented = _segment(word)
+        if segmented is None:
+            return None
+        syllables += segmented
+    return syllables
+
+
+def build_syllable_index(entries, strip):
+    """
+    Map every hanzi to its most frequent toneless syllable.
+
+    ``entries`` yields (chinese, pinyin) pairs; ``strip`` removes punctuation
+    from the Chinese text. Entries whose syllable count does not match their
+    character count (numbers, latin letters, typos in the data) are skipped.
+    """
+    readings = defaultdict(Counter)
+    for chinese, pinyin in entries:
+        hanzi = strip(chinese)
+        syllables = split_syllables(pinyin or "")
+        if syllables is None or len(syllables) != len(hanzi):
+            continue
+        for ch, syllable in zip(hanzi, syllables):
+            readings[ch][syllable] += 1
+    # Interned so that equal syllables are the same object
+    return {ch: sys.intern(counter.most_common(1)[0][0]) for ch, counter in readings.items()}
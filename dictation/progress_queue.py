@@ -0,0 +1,147 @@
+"""
+Write-behind queue for character progress updates.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from .db_helpers import write_character_progress
+
+# Seconds between background flushes; 0 writes every answer synchronously
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", "1.0"))
+# Pending (user, hanzi) rows that trigger a flush before the interval elapses
+PROGRESS_QUEUE_MAX_DEPTH = int(os.environ.get("PROGRESS_QUEUE_MAX_DEPTH", "500"))
+
+
+class ProgressWriteQueue:
+    """
+    Collects the character progress updates of scored answers and writes them
+    to Supabase from a background thread, so that rendering a correction no
+    longer waits for a SELECT and an UPSERT.
+
+    Updates are coalesced per user and hanzi: a character answered several
+    times between two flushes becomes one upserted row, its answers replayed
+    in order by ``writer`` (write_character_progress). One flush writes at a
+    time, so concurrent requests of the same user cannot lose updates.
+
+    The thread is started lazily by the first enqueue of each process (with
+    ``preload_app`` the app is imported before gunicorn forks, and threads do
+    not survive a fork). ``drain`` stops it and writes what is left; gunicorn
+    calls it from ``worker_exit``.
+    """
+
+    def __init__(self, writer: Callable[[str, Dict[str, Tuple[int, List[bool]]]], None],
+                 flush_interval: float = 1.0, max_depth: int = 500):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+        # user_id -> hanzi -> (hsk_level, [correct, ...])
+        self._pending: Dict[str, Dict[str, Tuple[int, List[bool]]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.depth = 0
+        self.enqueued = 0
+        self.coalesced = 0
+        self.written = 0
+        self.failures = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def enqueue(self, user_id: str, hanzi_updates: list) -> None:
+        """Queue {"hanzi", "hsk_level", "correct"} updates of one answer."""
+        with self._lock:
+            pending = self._pending.setdefault(user_id, {})
+            for update in hanzi_updates:
+                entry = pending.get(update["hanzi"])
+                if entry is None:
+                    pending[update["hanzi"]] = (update["hsk_level"], [update["correct"]])
+                    self.depth += 1
+                else:
+                    entry[1].append(update["correct"])
+                    self.coalesced += 1
+            self.enqueued += len(hanzi_updates)
+            depth = self.depth
+        if self.flush_interval <= 0 or self._stopping:
+            self.flush()
+            return
+        self._ensure_thread()
+        if depth >= self.max_depth:
+            self._wake.set()
+
+    def _ensure_thread(self) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                self._pid = pid
+                self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self, user_id: str = None) -> None:
+        """Write the pending updates now, of every user or only of ``user_id``."""
+        with self._flush_lock:
+            with self._lock:
+                if user_id is None:
+                    batch, self._pending = self._pending, {}
+                else:
+                    batch = {user_id: self._pending.pop(user_id)} if user_id in self._pending else {}
+                self.depth -= sum(len(answers) for answers in batch.values())
+            if not batch:
+                return
+            start = time.perf_counter()
+            for uid, answers in batch.items():
+                try:
+                    self.writer(uid, answers)
+                    self.written += len(answers)
+                except Exception as e:
+                    self.failures += 1
+                    logging.error(f"Error writing queued character progress for user {uid}: {e}")
+            elapsed = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+
+    def drain(self, timeout: float = 10.0) -> None:
+        """Stop the background thread and write everything still queued."""
+        self._stopping = True
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth, counters and flush latency, e.g. for the health endpoint."""
+        with self._lock:
+            return {
+                "depth": self.depth,
+                "users": len(self._pending),
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "written": self.written,
+                "failures": self.failures,
+                "flushes": self.flushes,
+                "last_flush_ms": round(self.last_flush_ms, 1),
+                "max_flush_ms": round(self.max_flush_ms, 1),
+            }
+
+
+progress_queue = ProgressWriteQueue(write_character_progress, PROGRESS_FLUSH_INTERVAL, PROGRESS_QUEUE_MAX_DEPTH)
+# Development server and scripts; gunicorn workers drain from the worker_exit hook
+atexit.register(progress_queue.drain)
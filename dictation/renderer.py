@@ -0,0 +1,90 @@
+"""
+HTML rendering of corrector alignments.
+"""
+
+# Precompiled span fragments, one per operation; the character goes in between
+SPAN_CLOSE = "</span>"
+CORRECT_OPEN = "<span class='diff-correct'>"
+WRONG_OPEN = "<span class='diff-del'>"
+MISSING_OPEN = "<span class='diff-ins'>"
+EXTRA_OPEN = "<span class='diff-extra'>"
+HOMOPHONE_OPEN = "<span class='diff-homophone'>"
+
+
+def render_correction(ops, s_user, target, parts=None):
+    """
+    Render alignment operation codes (see Alignment.ops) over the correct
+    sentence's punctuation skeleton.
+
+    Extra user characters are shown right before the correct character they
+    precede (after its leading punctuation); extras after the last correct
+    character are not shown. ``ops`` may also cover only a prefix of the
+    correct sentence (live corrections); the rendering then stops after the
+    punctuation following that prefix. Builds the HTML in one list and joins
+    it once; callers rendering many corrections can pass the same ``parts``
+    list to reuse it.
+
+    Returns:
+        Tuple of (html, correct_segments) where correct_segments is the string
+        of user characters that matched the correct sentence.
+    """
+    skeleton = target.skeleton
+    s_correct = target.stripped
+    m = len(s_correct)
+    if parts is None:
+        parts = []
+    else:
+        parts.clear()
+    matched = []
+    u_idx = c_idx = 0
+    opened = False  # whether skeleton[c_idx] has been emitted
+    for code in ops:
+        if c_idx == m:
+            break
+        if not opened:
+            parts.append(skeleton[c_idx])
+            opened = True
+        if code == 'd':
+            parts += (EXTRA_OPEN, s_user[u_idx], SPAN_CLOSE)
+            u_idx += 1
+            continue
+        if code == 'e':
+            ch = s_user[u_idx]
+            parts += (CORRECT_OPEN, ch, SPAN_CLOSE)
+            matched.append(ch)
+            u_idx += 1
+        elif code == 'r':
+            parts += (WRONG_OPEN, s_user[u_idx], SPAN_CLOSE, MISSING_OPEN, s_correct[c_idx], SPAN_CLOSE)
+            u_idx += 1
+        elif code == 'h':
+            parts += (HOMOPHONE_OPEN, s_user[u_idx], SPAN_CLOSE, MISSING_OPEN, s_correct[c_idx], SPAN_CLOSE)
+            u_idx += 1
+        else:
+            parts += (MISSING_OPEN, s_correct[c_idx], SPAN_CLOSE)
+        c_idx += 1
+        opened = False
+    if not opened:
+        parts.append(skeleton[c_idx])
+    return ''.join(parts), ''.join(matched)
+
+
+# Shown in place of a skipped character while typing, without giving it away
+SKIPPED_MARK = MISSING_OPEN + "＿" + SPAN_CLOSE
+LIVE_OPEN = {'e': CORRECT_OPEN, 'r': WRONG_OPEN, 'h': HOMOPHONE_OPEN, 'd': EXTRA_OPEN}
+
+
+def render_live(ops, s_user):
+    """
+    Render the user's own characters for an as-you-type correction: correct,
+    wrong, homophone and extra characters are marked, skipped correct characters only
+    show a placeholder so the answer is not revealed before submitting.
+    """
+    parts = []
+    u_idx = 0
+    for code in ops:
+        if code == 'i':
+            parts.append(SKIPPED_MARK)
+            continue
+        parts += (LIVE_OPEN[code], s_user[u_idx], SPAN_CLOSE)
+        u_idx += 1
+    return ''.join(parts)
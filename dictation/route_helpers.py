@@ -198,34 +198,31 @@ def handle_conversation_submit_all(conversation_id: str, user_id: Optional[str],
         all_inputs[sentence_id] = value
     
     # Use the form handler to process all inputs
-    form_handler = ConversationFormHandler(corrector)
+    form_handler = ConversationFormHandler(corrector, ctx)
     result = form_handler.process_conversation_batch(conversation, all_inputs)
     
     # Update character progress for logged-in users
     if user_id:
-        from .db_helpers import batch_update_character_progress
-        hanzi_updates = []
-        for correction in result["all_corrections"]:
-            sentence = next((s for s in conversation["sentences"] if str(s["id"]) == correction["sentence_id"]), None)
-            if sentence:
-                for hanzi in set(sentence["chinese"]):
-                    match = next((entry for entry in ctx.hsk_data if entry["hanzi"] == hanzi), None)
-                    if match:
-                        hsk_level = match["hsk_level"]
-                        if isinstance(hsk_level, str) and hsk_level.startswith("HSK"):
-                            hsk_level_int = int(hsk_level.replace("HSK", ""))
-                        else:
-                            hsk_level_int = int(hsk_level)
-                        # Determine if character was correct based on accuracy
-                        correct = correction["accuracy"] >= 70  # Threshold for "correct"
-                        hanzi_updates.append({
-                            "hanzi": hanzi,
-                            "hsk_level": hsk_level_int,
-                            "correct": correct
-                        })
+        from .progress_queue import progress_queue
+        # all_corrections follows the order of conversation["sentences"]
+        hanzi_updates = {}
+        for sentence, correction in zip(conversation["sentences"], result["all_corrections"]):
+            # Determine if characters were correct based on accuracy
+            correct = correction["accuracy"] >= 70  # Threshold for "correct"
+            for hanzi, hsk_level, _ in ctx.get_update_plan(sentence["chinese"]):
+                # A hanzi repeated across sentences is sent once (an upsert
+                # cannot touch the same row twice); it counts as correct
+                # only if every sentence containing it was
+                previous = hanzi_updates.get(hanzi)
+                hanzi_updates[hanzi] = {
+                    "hanzi": hanzi,
+                    "hsk_level": hsk_level,
+                    "correct": correct and (previous is None or previous["correct"])
+                }
+        hanzi_updates = list(hanzi_updates.values())
         
         if hanzi_updates:
-            batch_update_character_progress(user_id, hanzi_updates)
+            progress_queue.enqueue(user_id, hanzi_updates)
     
     # Return results for display
     return render_template("correction_conversation.html", 
@@ -1,10 +1,14 @@
 from dotenv import load_dotenv
 import os
+import uuid
 load_dotenv()
 
 from flask import Blueprint, render_template, request, session, redirect, flash, url_for, g, send_from_directory
 from .app_context import DictationContext
-from .corrector import Corrector
+from .corrector import Corrector, correction_cache, live_cache, live_input_limit, strip_punct_and_space, PINYIN_TOLERANT
+from .renderer import render_live
+from .progress_queue import progress_queue
+from .outbox import outbox
 from .db_helpers import (
     update_character_progress,
     update_daily_work_registry,
@@ -33,15 +37,15 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 dictation_bp = Blueprint("dictation", __name__)
 ctx = DictationContext()
-corrector = Corrector()
+corrector = Corrector(syllables=ctx.syllables if PINYIN_TOLERANT else None)
 session_manager = SessionManager(ctx, supabase)
 story_handler = StorySessionHandler(session_manager)
 conversation_handler = ConversationSessionHandler(session_manager)
 
 # Initialize form handlers
-hsk_form_handler = HSKFormHandler(corrector)
-story_form_handler = StoryFormHandler(corrector)
-conversation_form_handler = ConversationFormHandler(corrector)
+hsk_form_handler = HSKFormHandler(corrector, ctx)
+story_form_handler = StoryFormHandler(corrector, ctx)
+conversation_form_handler = ConversationFormHandler(corrector, ctx)
 auth_form_handler = AuthenticationFormHandler()
 
 
@@ -52,7 +56,20 @@ auth_form_handler = AuthenticationFormHandler()
 @dictation_bp.route("/health")
 def health_check():
     """Simple health check endpoint for monitoring and keeping app alive"""
-    return {"status": "ok", "service": "chinese-dictation"}, 200
+    # Public endpoint: counts only, no error messages or configuration
+    cache = correction_cache.stats()
+    queue = progress_queue.stats()
+    pending = outbox.stats() if outbox else None
+    return {
+        "status": "ok",
+        "service": "chinese-dictation",
+        "correction_cache": {"hits": cache["hits"], "misses": cache["misses"], "evictions": cache["evictions"]},
+        "live_sessions": len(live_cache),
+        "progress_queue": {"depth": queue["depth"], "failures": queue["failures"]},
+        "outbox": {"pending": pending["pending"], "dead": pending["dead"], "failures": pending["failures"]} if pending else None,
+        "audio_files": len(ctx.audio),
+        "missing_audio": len(ctx.missing_audio),
+    }, 200
 
 @dictation_bp.route("/")
 def menu():
@@ -140,28 +157,24 @@ def dashboard():
     User dashboard showing HSK progress and daily work statistics.
     """
     user_id = session.get("user_id")
+    # Write this user's queued answers first so the dashboard includes them
+    progress_queue.flush(user_id)
+    if outbox:
+        outbox.flush(user_id)
     levels = get_user_progress_summary(user_id, ctx)
     daily_stats = get_daily_work_stats(user_id) if user_id else {"today_sentences_above_7": 0, "today_total_sentences": 0, "current_streak": 0, "last_7_days": []}
     return render_template("dashboard.html", levels=levels, daily_stats=daily_stats)
 
-@dictation_bp.before_app_request
-def setup_request_context():
-    """
-    Setup request context including authentication and daily session count.
-    """
-    # No guest users - users must be logged in to use the app
-    # (Currently a no-op, but could be used for authentication enforcement)
-    
-    # Inject daily session count
-    user_id = session.get("user_id")
-    if user_id:
-        g.daily_session_count = get_daily_session_count(user_id)
-    else:
-        g.daily_session_count = None
-
 @dictation_bp.app_context_processor
 def inject_daily_session_count_context():
-    return {"daily_session_count": getattr(g, "daily_session_count", None)}
+    """
+    Daily session count for the header. Context processors only run when a
+    template is rendered, so health checks, audio and JSON routes skip the lookup.
+    """
+    if "daily_session_count" not in g:
+        user_id = session.get("user_id")
+        g.daily_session_count = get_daily_session_count(user_id) if user_id else None
+    return {"daily_session_count": g.daily_session_count}
 
 @dictation_bp.route("/login", methods=["GET", "POST"])
 @handle_errors("login")
@@ -250,6 +263,9 @@ def hsk_level_detail(level):
     user_id = session.get("user_id")
     try:
         level = int(level)  # Ensure level is int for comparison
+        progress_queue.flush(user_id)
+        if outbox:
+            outbox.flush(user_id)
         # Get user progress for this level
         progress_rows = supabase.table("character_progress") \
             .select("hanzi, grade") \
@@ -313,6 +329,42 @@ def conversation_session(conversation_id):
     
     return conversation_handler.handle_session(conversation_id, user_id)
 
+# Session classes whose current item the live correction endpoint checks against
+LIVE_CORRECTION_SESSIONS = {"hsk": HSKSession, "story": StorySession, "conversation": ConversationSession}
+
+@dictation_bp.route("/live-correction", methods=["POST"])
+def live_correction():
+    """
+    As-you-type correction for the dictation form. Takes JSON
+    {"mode": "hsk" | "story" | "conversation", "user_input": "..."} and returns
+    the correction of what has been typed so far for the session's current sentence.
+    """
+    data = request.get_json(silent=True) or {}
+    session_class = LIVE_CORRECTION_SESSIONS.get(data.get("mode"))
+    user_input = data.get("user_input", "")
+    if session_class is None or not isinstance(user_input, str):
+        return {"error": "Invalid request"}, 400
+    is_valid, error_message = hsk_form_handler.validate_user_input(user_input)
+    if not is_valid:
+        return {"error": error_message}, 400
+
+    item = session_class(ctx).get_current_item()
+    if not item:
+        return {"error": "No sentence in progress"}, 404
+
+    target = ctx.get_target(item["chinese"])
+    if len(strip_punct_and_space(user_input)) > live_input_limit(target):
+        return {"error": "Answer is much longer than the sentence"}, 400
+
+    # The alignment table is kept per browser session and extended keystroke by keystroke
+    live_id = session.setdefault("live_id", uuid.uuid4().hex)
+    alignment = corrector.align_prefix(user_input, target, (live_id, data["mode"]))
+    return {
+        "correction": render_live(alignment.ops, alignment.stripped_user),
+        "correct": alignment.correct_count,
+        "typed": len(alignment.stripped_user),
+    }, 200
+
 @dictation_bp.route("/audio/<category>/<filename>")
 def serve_audio(category, filename):
     """Serve audio files with proper caching headers"""
@@ -1,13 +1,13 @@
 from flask import session
-from .corrector import Corrector
-from .db_helpers import batch_update_character_progress
+from .corrector import Corrector, PINYIN_TOLERANT
+from .progress_queue import progress_queue
 import logging
 
 class BaseDictationSession:
     def __init__(self, ctx):
         self.ctx = ctx
         self.session = session
-        self.corrector = Corrector()
+        self.corrector = Corrector(syllables=ctx.syllables if PINYIN_TOLERANT else None)
 
     def get_current_index(self):
         return self.session.get(self.index_key, 0)
@@ -40,6 +40,26 @@ class BaseDictationSession:
             self.session["accuracy_scores"] = []
         self.session["accuracy_scores"].append(accuracy)
 
+    def character_updates(self, text, alignment):
+        """
+        Character progress updates for an answered sentence, from the context's
+        precomputed plan: a hanzi is correct if it was typed correctly at least once.
+        Characters an accepted alternative leaves out (optional particles) are not
+        updated at all.
+        """
+        plan = self.ctx.get_update_plan(text)
+        correct_mask = alignment.correct_mask
+        if alignment.target.text != text:
+            target = alignment.target
+            if target.main_positions is None:
+                # Not an alternative of this sentence: positions do not line up
+                correct_hanzi = alignment.correct_hanzi
+                return [{"hanzi": hanzi, "hsk_level": level, "correct": hanzi in correct_hanzi} for hanzi, level, _ in plan]
+            # Scored against an alternative answer (e.g. traditional characters)
+            correct_mask = target.main_mask(correct_mask)
+            plan = [entry for entry in plan if entry[2] & target.main_covered]
+        return [{"hanzi": hanzi, "hsk_level": level, "correct": bool(positions & correct_mask)} for hanzi, level, positions in plan]
+
     def get_last_session_mean(self):
         scores = self.session.get("accuracy_scores", [])
         if not scores:
@@ -93,8 +113,8 @@ class HSKSession(BaseDictationSession):
     def update_score(self, user_input):
         item = self.get_current_item()
         hsk_level = item["hsk_level"]
-        correction, stripped_user, stripped_correct, correct_segments = self.corrector.compare(user_input, item["chinese"])
-        accuracy = round(len(correct_segments)/len(stripped_correct)*100) if len(stripped_correct) > 0 else 0
+        alignment = self.corrector.align(user_input, self.ctx.get_target(item["chinese"]))
+        accuracy = alignment.accuracy
         feedback, feedback_color = self.get_gradient_feedback(accuracy)
         
         # Append accuracy scores to session for later averaging
@@ -103,23 +123,9 @@ class HSKSession(BaseDictationSession):
         user_id = self.session.get("user_id")
         # Update character progress for logged-in users
         if user_id:
-            hanzi_updates = []
-            for hanzi in set(item["chinese"]):
-                match = next((entry for entry in self.ctx.hsk_data if entry["hanzi"] == hanzi), None)
-                if match:
-                    hsk_level = match["hsk_level"]
-                    if isinstance(hsk_level, str) and hsk_level.startswith("HSK"):
-                        hsk_level_int = int(hsk_level.replace("HSK", ""))
-                    else:
-                        hsk_level_int = int(hsk_level)
-                    correct = hanzi in correct_segments
-                    hanzi_updates.append({
-                        "hanzi": hanzi,
-                        "hsk_level": hsk_level_int,
-                        "correct": correct
-                    })
+            hanzi_updates = self.character_updates(item["chinese"], alignment)
             if hanzi_updates:
-                batch_update_character_progress(user_id, hanzi_updates)
+                progress_queue.enqueue(user_id, hanzi_updates)
     
         # Calculate running average accuracy for display
         return {
@@ -127,7 +133,7 @@ class HSKSession(BaseDictationSession):
             "correct_sentence": item["chinese"],
             "result": feedback,
             "result_color": feedback_color,
-            "correction": correction,
+            "correction": alignment.html,
             "accuracy": accuracy,
             "translation": item["translation"],
             "pinyin": item["pinyin"],
@@ -157,28 +163,22 @@ class ConversationSession(BaseDictationSession):
     def get_context(self):
         sentence = self.get_current_item()
         conversation_id = self.session.get("conversation_id")
-        conversation = self.ctx.get_conversation(conversation_id)
-        hsk_level = conversation["hsk_level"]
-        
-        # Add audio file path to each sentence
-        conversation_sentences = []
-        for sent in conversation["sentences"]:
-            sent_copy = sent.copy()
-            sent_copy["audio_file"] = self.ctx.conversation_audio_path(conversation_id, sent["id"])
-            conversation_sentences.append(sent_copy)
-        
+        # Shared, prebuilt payload: sentences with their audio, topic and level
+        payload = self.ctx.get_conversation_payload(conversation_id)
+        line = self.ctx.get_conversation_line(conversation_id, sentence["id"])
+
         return {
             "correct_sentence": sentence["chinese"],
-            "audio_file": self.ctx.conversation_audio_path(conversation_id, sentence["id"]),
-            "level": hsk_level,
+            "audio_file": line.audio_file,
+            "level": payload.hsk_level,
             "show_result": False,
             "session_mode": True,
             "current": self.get_current_index() + 1,
             "total": len(self.get_ids()),
             "conversation_mode": True,
-            "conversation_topic": conversation["topic"],
-            "conversation_audio_files": self.ctx.conversation_all_audio_paths(conversation_id),
-            "conversation_sentences": conversation_sentences,
+            "conversation_topic": payload.topic,
+            "conversation_audio_files": payload.audio_files,
+            "conversation_sentences": payload.sentences,
             "current_sentence_id": sentence["id"],
             "speaker": sentence["speaker"]
         }
@@ -186,10 +186,10 @@ class ConversationSession(BaseDictationSession):
     def update_score(self, user_input):
         sentence = self.get_current_item()
         conversation_id = self.session.get("conversation_id")
-        conversation = self.ctx.get_conversation(conversation_id)
-        hsk_level = conversation["hsk_level"]
-        correction, stripped_user, stripped_correct, correct_segments = self.corrector.compare(user_input, sentence["chinese"])
-        accuracy = round(len(correct_segments)/len(stripped_correct)*100) if len(stripped_correct) > 0 else 0
+        payload = self.ctx.get_conversation_payload(conversation_id)
+        line = self.ctx.get_conversation_line(conversation_id, sentence["id"])
+        alignment = self.corrector.align(user_input, self.ctx.get_target(sentence["chinese"]))
+        accuracy = alignment.accuracy
         feedback, feedback_color = self.get_gradient_feedback(accuracy)
         
         # Append accuracy scores to session for later averaging
@@ -199,23 +199,9 @@ class ConversationSession(BaseDictationSession):
 
         # Update character progress for logged-in users
         if user_id:
-            hanzi_updates = []
-            for hanzi in set(sentence["chinese"]):
-                match = next((entry for entry in self.ctx.hsk_data if entry["hanzi"] == hanzi), None)
-                if match:
-                    hsk_level = match["hsk_level"]
-                    if isinstance(hsk_level, str) and hsk_level.startswith("HSK"):
-                        hsk_level_int = int(hsk_level.replace("HSK", ""))
-                    else:
-                        hsk_level_int = int(hsk_level)
-                    correct = hanzi in correct_segments
-                    hanzi_updates.append({
-                        "hanzi": hanzi,
-                        "hsk_level": hsk_level_int,
-                        "correct": correct
-                    })
+            hanzi_updates = self.character_updates(sentence["chinese"], alignment)
             if hanzi_updates:
-                batch_update_character_progress(user_id, hanzi_updates)
+                progress_queue.enqueue(user_id, hanzi_updates)
             
         # Calculate running average accuracy for display
         return {
@@ -223,23 +209,23 @@ class ConversationSession(BaseDictationSession):
             "correct_sentence": sentence["chinese"],
             "result": feedback,
             "result_color": feedback_color,
-            "correction": correction,
+            "correction": alignment.html,
             "accuracy": accuracy,
             "translation": sentence["english"],
             "pinyin": sentence["pinyin"],
             "user_input": user_input,
             # Session/progress info
-            "level": hsk_level,
+            "level": payload.hsk_level,
             "show_result": True,
-            "audio_file": self.ctx.conversation_audio_path(conversation_id, sentence["id"]),
+            "audio_file": line.audio_file,
             "session_mode": True,
             "current": self.get_current_index() + 1,
             "total": len(self.get_ids()),
             "show_next_button": True,
             # Conversation info
             "conversation_mode": True,
-            "conversation_topic": conversation["topic"],
-            "conversation_audio_files": self.ctx.conversation_all_audio_paths(conversation_id),
+            "conversation_topic": payload.topic,
+            "conversation_audio_files": payload.audio_files,
             "conversation_id": conversation_id,
             "sentence_id": sentence["id"],
             "speaker": sentence["speaker"]
@@ -280,8 +266,8 @@ class StorySession(BaseDictationSession):
         story_id = self.session.get("story_id")
         story = self.ctx.get_story(story_id)
         hsk_level = story["hsk_level"]
-        correction, stripped_user, stripped_correct, correct_segments = self.corrector.compare(user_input, part["chinese"])
-        accuracy = round(len(correct_segments)/len(stripped_correct)*100) if len(stripped_correct) > 0 else 0
+        alignment = self.corrector.align(user_input, self.ctx.get_target(part["chinese"]))
+        accuracy = alignment.accuracy
         feedback, feedback_color = self.get_gradient_feedback(accuracy)
         
          # Append accuracy scores to session for later averaging
@@ -294,23 +280,9 @@ class StorySession(BaseDictationSession):
 
         # Update character progress for logged-in users
         if user_id:
-            hanzi_updates = []
-            for hanzi in set(part["chinese"]):
-                match = next((entry for entry in self.ctx.hsk_data if entry["hanzi"] == hanzi), None)
-                if match:
-                    hsk_level = match["hsk_level"]
-                    if isinstance(hsk_level, str) and hsk_level.startswith("HSK"):
-                        hsk_level_int = int(hsk_level.replace("HSK", ""))
-                    else:
-                        hsk_level_int = int(hsk_level)
-                    correct = hanzi in correct_segments
-                    hanzi_updates.append({
-                        "hanzi": hanzi,
-                        "hsk_level": hsk_level_int,
-                        "correct": correct
-                    })
+            hanzi_updates = self.character_updates(part["chinese"], alignment)
             if hanzi_updates:
-                batch_update_character_progress(user_id, hanzi_updates)
+                progress_queue.enqueue(user_id, hanzi_updates)
             
         # Calculate running average accuracy for display
         return {
@@ -318,7 +290,7 @@ class StorySession(BaseDictationSession):
             "correct_sentence": part["chinese"],
             "result": feedback,
             "result_color": feedback_color,
-            "correction": correction,
+            "correction": alignment.html,
             "accuracy": accuracy,
             "translation": part["translation"],
             "pinyin": part["pinyin"],
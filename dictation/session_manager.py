@@ -7,6 +7,8 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 from .app_context import DictationContext
+from .outbox import outbox
+from .db_helpers import is_permanent_error
 
 
 class SessionManager:
@@ -15,6 +17,8 @@ class SessionManager:
     def __init__(self, ctx: DictationContext, supabase_client):
         self.ctx = ctx
         self.supabase = supabase_client
+        if outbox:
+            outbox.register("story_progress", self.apply_story_progress, is_permanent_error)
     
     def clear_session_data(self, session_type: str) -> None:
         """Clear session data for a specific session type."""
@@ -138,7 +142,7 @@ class SessionManager:
         return {"resumed": False, "index": session.get("conversation_session_index", 0), "total": len(conversation["sentences"])}
     
     def save_story_progress(self, user_id: str, story_id: str, current_index: int, score: int) -> bool:
-        """Save story progress to database."""
+        """Save story progress to database (recorded in the outbox when it is enabled)."""
         try:
             # Get story to calculate total_parts
             story = self.ctx.get_story(story_id)
@@ -146,35 +150,45 @@ class SessionManager:
                 logging.error(f"Story not found: {story_id}")
                 return False
             
-            total_parts = len(story["parts"])
-            
-            # Check if progress exists
-            result = self.supabase.table("story_progress").select("id").eq("user_id", user_id).eq("story_id", story_id).execute()
-            
-            if result.data:
-                # Update existing progress
-                logging.info(f"[DB] Updating existing progress for story {story_id}, setting index to {current_index}")
-                self.supabase.table("story_progress").update({
-                    "current_index": current_index,
-                    "score": score,
-                    "total_parts": total_parts,
-                    "last_updated": datetime.now().isoformat()
-                }).eq("user_id", user_id).eq("story_id", story_id).execute()
+            write = {
+                "user_id": user_id,
+                "story_id": story_id,
+                "current_index": current_index,
+                "score": score,
+                "total_parts": len(story["parts"]),
+                "last_updated": datetime.now().isoformat()
+            }
+            if outbox:
+                outbox.record("story_progress", write)
             else:
-                # Insert new progress
-                logging.info(f"[DB] Inserting new progress for story {story_id}, index {current_index}")
-                self.supabase.table("story_progress").insert({
-                    "user_id": user_id,
-                    "story_id": story_id,
-                    "current_index": current_index,
-                    "score": score,
-                    "total_parts": total_parts,
-                    "last_updated": datetime.now().isoformat()
-                }).execute()
+                self.apply_story_progress(write)
             return True
         except Exception as e:
             logging.error(f"Error saving story progress: {e}")
             return False
+
+    def apply_story_progress(self, write: Dict[str, Any], write_key: Optional[str] = None) -> None:
+        """
+        Store a user's position in a story. The row is set to absolute values,
+        so applying the same write twice (an outbox replay) is harmless.
+        """
+        user_id, story_id, current_index = write["user_id"], write["story_id"], write["current_index"]
+        # Check if progress exists
+        result = self.supabase.table("story_progress").select("id").eq("user_id", user_id).eq("story_id", story_id).execute()
+        
+        if result.data:
+            # Update existing progress
+            logging.info(f"[DB] Updating existing progress for story {story_id}, setting index to {current_index}")
+            self.supabase.table("story_progress").update({
+                "current_index": current_index,
+                "score": write["score"],
+                "total_parts": write["total_parts"],
+                "last_updated": write["last_updated"]
+            }).eq("user_id", user_id).eq("story_id", story_id).execute()
+        else:
+            # Insert new progress
+            logging.info(f"[DB] Inserting new progress for story {story_id}, index {current_index}")
+            self.supabase.table("story_progress").insert(write).execute()
     
 
     
@@ -0,0 +1,71 @@
+"""
+Prebuilt snapshot of the content files and every index derived from them.
+
+The snapshot is built at deploy time (developer_tools/build_content_snapshot.py)
+so that workers unpickle one file instead of parsing the JSON content and
+recompiling the corrector targets, update plans and syllable index on start.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import time
+
+# Bump when the layout of the snapshot itself changes
+SNAPSHOT_FORMAT = 1
+
+# Modules whose code builds the derived indexes: editing them invalidates the snapshot
+_DERIVED_FROM = ("app_context.py", "corrector.py", "alignment.py", "pinyin.py")
+
+
+def content_fingerprint(content_paths):
+    """sha256 of the content files and of the code that derives indexes from them."""
+    digest = hashlib.sha256(f"format {SNAPSHOT_FORMAT}".encode())
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = list(content_paths) + [os.path.join(package_dir, name) for name in _DERIVED_FROM]
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        try:
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        except FileNotFoundError:
+            # Optional content (stories, conversations) may be absent
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+def save_snapshot(path, content_paths, state):
+    """Write ``state`` with the fingerprint of ``content_paths``, atomically."""
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "fingerprint": content_fingerprint(content_paths),
+        "state": state,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return snapshot["fingerprint"]
+
+
+def load_snapshot(path, content_paths):
+    """
+    State saved by save_snapshot, or None when there is no snapshot or it was
+    built from other content (the caller then loads the JSON files).
+    """
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error(f"Content snapshot {path} is unreadable, loading JSON instead: {e}")
+        return None
+    if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("fingerprint") != content_fingerprint(content_paths):
+        logging.warning(f"Content snapshot {path} is stale, loading JSON instead "
+                        "(rebuild it with developer_tools/build_content_snapshot.py)")
+        return None
+    logging.info(f"Content snapshot {path} loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return snapshot["state"]
@@ -45,3 +45,26 @@ preload_app = True
 # Performance tuning
 worker_tmp_dir = "/dev/shm"  # Use shared memory for worker heartbeat (faster than disk)
 
+
+# Server hooks
+def post_fork(server, worker):
+    """Start every worker with its own empty correction caches and counters"""
+    from dictation.corrector import correction_cache, live_cache
+    from dictation.db_helpers import daily_session_counts
+    from dictation.outbox import outbox
+    correction_cache.clear()
+    live_cache.clear()
+    daily_session_counts.clear()
+    if outbox:
+        # Replay the writes left pending by the previous deploy without waiting for new ones
+        outbox.start()
+
+
+def worker_exit(server, worker):
+    """Write the character progress updates still queued before the worker exits"""
+    from dictation.progress_queue import progress_queue
+    from dictation.outbox import outbox
+    progress_queue.drain()
+    if outbox:
+        # Pending entries stay in the outbox file and are replayed by another worker
+        outbox.stop()
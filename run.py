@@ -3,4 +3,7 @@ from dictation import create_app
 app = create_app()
 
 if __name__ == "__main__":
+    from dictation.outbox import outbox
+    if outbox:
+        outbox.start()
     app.run(debug=True, port=5001, host="0.0.0.0")
\ No newline at end of file
@@ -0,0 +1,42 @@
+// As-you-type correction for the dictation form (see /live-correction)
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('dictation-form');
+    const userInput = document.getElementById('user_input');
+    const output = document.getElementById('live-correction');
+    if (!form || !userInput || !output || !form.dataset.liveMode || userInput.disabled) return;
+
+    let timer = null;
+    let lastSent = null;
+
+    function check() {
+        const text = userInput.value;
+        if (text === lastSent) return;
+        lastSent = text;
+        if (!text.trim()) {
+            output.innerHTML = '';
+            return;
+        }
+        fetch('/live-correction', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({mode: form.dataset.liveMode, user_input: text})
+        })
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                // Ignore answers to requests the learner has already typed past
+                if (data && userInput.value === text) output.innerHTML = data.correction;
+            })
+            .catch(() => {});
+    }
+
+    userInput.addEventListener('input', function(e) {
+        // Wait for the IME to commit the hanzi before checking
+        if (e.isComposing) return;
+        clearTimeout(timer);
+        timer = setTimeout(check, 150);
+    });
+    userInput.addEventListener('compositionend', function() {
+        clearTimeout(timer);
+        timer = setTimeout(check, 150);
+    });
+});
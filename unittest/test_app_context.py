@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import unittest
+from dictation.app_context import DictationContext, parse_hsk_level
+from dictation.corrector import Corrector, TargetProfile
+from dictation.session import HSKSession
+
+
+class TestDictationContext(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.ctx = DictationContext()
+
+    def test_parse_hsk_level(self):
+        self.assertEqual(parse_hsk_level(3), 3)
+        self.assertEqual(parse_hsk_level("3"), 3)
+        self.assertEqual(parse_hsk_level("HSK3"), 3)
+
+    def test_hanzi_levels(self):
+        self.assertEqual(len(self.ctx.hanzi_levels), len(self.ctx.hsk_data))
+        for entry in self.ctx.hsk_data:
+            self.assertEqual(self.ctx.hanzi_levels[entry["hanzi"]], parse_hsk_level(entry["hsk_level"]))
+        self.assertNotIn("。", self.ctx.hanzi_levels)
+
+    def test_update_plans(self):
+        text = '很久以前，有一个皇帝。'
+        plan = self.ctx.get_update_plan(text)
+        self.assertIs(plan, self.ctx.update_plans[text])
+        self.assertEqual([hanzi for hanzi, _, _ in plan], [ch for ch in '很久以前有一个皇帝' if ch in self.ctx.hanzi_levels])
+        self.assertEqual(dict((h, level) for h, level, _ in plan), {h: self.ctx.hanzi_levels[h] for h, _, _ in plan})
+        self.assertEqual(dict((h, mask) for h, _, mask in plan)['很'], 1)
+        # Unknown text is planned on the fly
+        self.assertEqual(self.ctx.get_update_plan('你好你'), (('你', 1, 0b101), ('好', 1, 0b010)))
+
+    def test_character_updates(self):
+        session = HSKSession(self.ctx)
+        alignment = Corrector(cache=None).align('你们你', self.ctx.get_target('你好你'))
+        self.assertEqual(session.character_updates('你好你', alignment), [
+            {"hanzi": '你', "hsk_level": 1, "correct": True},
+            {"hanzi": '好', "hsk_level": 1, "correct": False},
+        ])
+        # An accepted alternative credits the characters it stands in for, position by position
+        alternative = Corrector(cache=None).align('你好', TargetProfile('您好', ['你好']))
+        self.assertEqual(session.character_updates('您好', alternative), [
+            {"hanzi": '您', "hsk_level": self.ctx.hanzi_levels['您'], "correct": True},
+            {"hanzi": '好', "hsk_level": 1, "correct": True},
+        ])
+        alternative = Corrector(cache=None).align('我好', TargetProfile('您好', ['你好']))
+        self.assertEqual(session.character_updates('您好', alternative), [
+            {"hanzi": '您', "hsk_level": self.ctx.hanzi_levels['您'], "correct": False},
+            {"hanzi": '好', "hsk_level": 1, "correct": True},
+        ])
+        # Traditional characters of an alternative are credited to the simplified ones they replace
+        traditional = Corrector(cache=None).align('他是一個學生', TargetProfile('他是一个学生。', ['他是一個學生。']))
+        self.assertEqual(traditional.accuracy, 100)
+        updates = session.character_updates('他是一个学生。', traditional)
+        self.assertEqual([u["hanzi"] for u in updates], [h for h, _, _ in self.ctx.get_update_plan('他是一个学生。')])
+        self.assertIn('个', [u["hanzi"] for u in updates])
+        self.assertTrue(all(u["correct"] for u in updates))
+        # Characters the alternative leaves out are neither credited nor penalised
+        shorter = Corrector(cache=None).align('他是学生', TargetProfile('他是一个学生。', ['他是学生。']))
+        self.assertEqual(shorter.accuracy, 100)
+        updates = session.character_updates('他是一个学生。', shorter)
+        self.assertEqual([u["hanzi"] for u in updates], [h for h in '他是学生' if h in self.ctx.hanzi_levels])
+        self.assertTrue(all(u["correct"] for u in updates))
+        partial = Corrector(cache=None).align('他是一個學', TargetProfile('他是一个学生。', ['他是一個學生。']))
+        self.assertEqual({u["hanzi"]: u["correct"] for u in session.character_updates('他是一个学生。', partial)}["生"], False)
+
+    def test_story_and_conversation_indexes(self):
+        for story_id, story in self.ctx.stories.items():
+            for k, part in enumerate(story["parts"]):
+                self.assertIs(self.ctx.get_story_part(story_id, part["id"]), part)
+                self.assertEqual(self.ctx.get_story_part_index(story_id, part["id"]), k)
+        for conv_id, conversation in self.ctx.conversations.items():
+            for k, sentence in enumerate(conversation["sentences"]):
+                self.assertIs(self.ctx.get_conversation_sentence(int(conv_id), sentence["id"]), sentence)
+                self.assertEqual(self.ctx.get_conversation_sentence_index(conv_id, sentence["id"]), k)
+        self.assertIsNone(self.ctx.get_story_part("missing", "1"))
+        self.assertIsNone(self.ctx.get_conversation_sentence(None, 1))
+
+    def test_conversation_categories(self):
+        categories = sorted({c["category"] for c in self.ctx.conversations.values() if "category" in c})
+        self.assertEqual(list(self.ctx.get_available_categories()), categories)
+        for category in categories:
+            self.assertEqual(self.ctx.get_conversations_by_category(category),
+                             {cid: c for cid, c in self.ctx.conversations.items() if c.get("category") == category})
+        self.assertEqual(self.ctx.get_conversations_by_category("missing"), {})
+
+    def test_sentence_pools(self):
+        for level, pool in self.ctx.sentence_pools.items():
+            self.assertIsInstance(pool, tuple)
+            self.assertEqual(pool, tuple(sid for sid, s in self.ctx.sentences.items() if s["hsk_level"] == level))
+            self.assertEqual(self.ctx.get_phrases_by_level(str(level)), {sid: self.ctx.sentences[sid] for sid in pool})
+        ids = self.ctx.get_random_ids(level=2)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertTrue(all(self.ctx.sentences[sid]["hsk_level"] == 2 for sid in ids))
+        self.assertEqual(len(self.ctx.get_random_ids(count=3)), 3)
+        self.assertEqual(self.ctx.get_random_ids(level=9), [])
+        self.assertIs(self.ctx.get_phrases_by_level(), self.ctx.sentences)
+
+    def test_conversation_payloads(self):
+        for conv_id, conversation in self.ctx.conversations.items():
+            payload = self.ctx.get_conversation_payload(int(conv_id))
+            self.assertIs(payload, self.ctx.get_conversation_payload(conv_id))
+            self.assertEqual((payload.topic, payload.hsk_level), (conversation["topic"], conversation["hsk_level"]))
+            self.assertEqual([line.id for line in payload.sentences], [s["id"] for s in conversation["sentences"]])
+            for line in payload.sentences:
+                self.assertEqual(line.audio_file, self.ctx.conversation_audio_path(conv_id, line.id))
+                self.assertIs(self.ctx.get_conversation_line(conv_id, line.id), line)
+            self.assertEqual(self.ctx.conversation_all_audio_paths(conv_id), payload.audio_files)
+        with self.assertRaises(AttributeError):
+            payload.sentences[0].audio_file = None
+        self.assertIsNone(self.ctx.get_conversation_payload("missing"))
+
+    def test_conversation_payloads_follow_audio_refresh(self):
+        ctx = DictationContext()
+        before = ctx.get_conversation_payload("1")
+        ctx.audio.refresh()
+        after = ctx.get_conversation_payload("1")
+        self.assertIsNot(after, before)
+        self.assertEqual(after, before)
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "snapshot.pickle")
+            built = DictationContext(snapshot_path=None)
+            built.save_snapshot(path)
+            loaded = DictationContext(snapshot_path=path)
+            self.assertEqual(loaded.snapshot_state().keys(), built.snapshot_state().keys())
+            for name in ("sentences", "sentence_pools", "hanzi_levels", "hsk_totals", "update_plans", "syllables", "categories"):
+                self.assertEqual(getattr(loaded, name), getattr(built, name))
+            # Shared references survive: the level partitions hold the same sentence dicts
+            sid = next(iter(loaded.sentences))
+            level = parse_hsk_level(loaded.sentences[sid]["hsk_level"])
+            self.assertIs(loaded.sentences_by_level[level][sid], loaded.sentences[sid])
+            text = loaded.sentences[sid]["chinese"]
+            self.assertEqual(loaded.get_target(text).index_map, built.get_target(text).index_map)
+            # Audio-derived state is rebuilt, not restored
+            self.assertEqual(loaded.conversation_payloads, built.conversation_payloads)
+            self.assertEqual(loaded.missing_audio, built.missing_audio)
+
+    def test_stale_snapshot_falls_back_to_json(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {}
+            for name in ("sentences.json", "hsk_characters.json", "stories.json", "conversations.json"):
+                paths[name] = shutil.copy(name, tmp)
+            content = dict(json_path=paths["sentences.json"], hsk_path=paths["hsk_characters.json"],
+                           stories_path=paths["stories.json"], conversations_path=paths["conversations.json"])
+            snapshot = os.path.join(tmp, "snapshot.pickle")
+            DictationContext(snapshot_path=None, **content).save_snapshot(snapshot)
+            with open(paths["sentences.json"], "w", encoding="utf-8") as f:
+                f.write('{"new": {"chinese": "新句子。", "pinyin": "xīn jùzi.", "english": "New sentence.", "hsk_level": 1}}')
+            with self.assertLogs(level="WARNING") as logs:
+                ctx = DictationContext(snapshot_path=snapshot, **content)
+            self.assertTrue(any("stale" in line for line in logs.output))
+            self.assertEqual(list(ctx.sentences), ["new"])
+            self.assertIn("新句子。", ctx.targets)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from dictation.audio_index import AudioIndex
+
+
+class TestAudioIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.audio_dir = os.path.join(self.tmp.name, "audio_files")
+        os.makedirs(os.path.join(self.audio_dir, "stories"))
+        self.touch("stories/story_1_1.mp3")
+        self.touch("story_1_2.mp3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def touch(self, path):
+        open(os.path.join(self.audio_dir, path), "wb").close()
+
+    def test_resolve_prefers_organised_layout(self):
+        self.touch("story_1_1.mp3")
+        index = AudioIndex(self.audio_dir)
+        self.assertEqual(index.source, "scan")
+        self.assertEqual(index.resolve("stories", "story_1_1.mp3"), "stories/story_1_1.mp3")
+        self.assertEqual(index.resolve("stories", "story_1_2.mp3"), "story_1_2.mp3")
+        self.assertIsNone(index.resolve("stories", "story_1_3.mp3"))
+        self.assertIsNone(index.resolve("conversations", "stories"))
+
+    def test_refresh_interval(self):
+        index = AudioIndex(self.audio_dir, refresh_interval=60)
+        self.touch("stories/story_1_3.mp3")
+        self.assertIsNone(index.resolve("stories", "story_1_3.mp3"))
+        index.built_at = time.monotonic() - 61
+        self.assertEqual(index.resolve("stories", "story_1_3.mp3"), "stories/story_1_3.mp3")
+
+    def test_manifest_fallback(self):
+        manifest_path = os.path.join(self.tmp.name, "manifest.json")
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "hsk_characters": {"1_HSK1.mp3": {"size_mb": 0.01, "path": "hsk_characters/1_HSK1.mp3"}},
+                "conversations": {"2": {"files": {"conv_2_1.mp3": {"size_mb": 0.01, "path": "conversations/conv_2_1.mp3"}}}},
+                "stories": {},
+            }, f)
+        index = AudioIndex(os.path.join(self.tmp.name, "missing"), manifest_path=manifest_path)
+        self.assertEqual(index.source, "manifest")
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.resolve("hsk_characters", "1_HSK1.mp3"), "hsk_characters/1_HSK1.mp3")
+        self.assertIsNone(index.resolve("stories", "story_1_1.mp3"))
+
+
+if __name__ == '__main__':
+    unittest.main()
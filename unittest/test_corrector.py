@@ -1,44 +1,224 @@
+import random
 import unittest
-from dictation.corrector import Corrector
+from dictation.cache import LRUCache
+from dictation.corrector import Corrector, TargetProfile, live_input_limit
+from dictation.alignment import ENGINES, IncrementalAligner, VariantTrie, trie_align, dp_align, bitparallel_align, linear_align, banded_align
+from dictation.pinyin import build_syllable_index, split_syllables
+from dictation.renderer import render_live
+
+
+def ok(text):
+    return ''.join(f"<span class='diff-correct'>{ch}</span>" for ch in text)
+
+def span(cls, ch):
+    return f"<span class='diff-{cls}'>{ch}</span>"
+
 
 class TestCorrector(unittest.TestCase):
     def setUp(self):
-        self.corrector = Corrector()
+        self.correctors = [Corrector(engine, cache=None) for engine in ENGINES]
 
     def check(self, user_input, correct, expected_html):
-        correction, *_ = self.corrector.compare(user_input, correct)
-        self.assertEqual(correction, expected_html)
+        for corrector in self.correctors:
+            correction, *_ = corrector.compare(user_input, correct)
+            self.assertEqual(correction, expected_html)
 
     def test_perfect_match(self):
-        self.check('很久以前，有一个皇帝。', '很久以前，有一个皇帝。', '很久以前，有一个皇帝。')
+        self.check('很久以前，有一个皇帝。', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个皇帝') + '。')
 
     def test_missing_character(self):
-        self.check('很久以前，有一个皇', '很久以前，有一个皇帝。', "很久以前，有一个皇<span class='diff-ins'>帝</span>")
+        self.check('很久以前，有一个皇', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个皇') + span('ins', '帝') + '。')
 
     def test_extra_character(self):
-        self.check('很久以前，有一个皇帝帝。', '很久以前，有一个皇帝。', "很久以前，有一个皇帝<span class='diff-del'>帝</span>。")
+        self.check('很久以前，有一个皇帝帝。', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个皇') + span('extra', '帝') + ok('帝') + '。')
 
     def test_wrong_character(self):
-        self.check('很久以前，有一个皇狗。', '很久以前，有一个皇帝。', "很久以前，有一个皇<span class='diff-del'>狗</span><span class='diff-ins'>帝</span>。")
+        self.check('很久以前，有一个皇狗。', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个皇') + span('del', '狗') + span('ins', '帝') + '。')
 
     def test_missing_punctuation(self):
-        self.check('很久以前有一个皇帝', '很久以前，有一个皇帝。', '很久以前，有一个皇帝。')
+        self.check('很久以前有一个皇帝', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个皇帝') + '。')
 
     def test_different_punctuation_type(self):
-        self.check('很久以前,有一个皇帝。', '很久以前，有一个皇帝。', '很久以前，有一个皇帝。')
+        self.check('很久以前,有一个皇帝。', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个皇帝') + '。')
 
     def test_mismatched_punctuation(self):
-        self.check('很，久以前有一个皇帝。', '很久以前，有一个皇帝。', '很久以前，有一个皇帝。')
+        self.check('很，久以前有一个皇帝。', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个皇帝') + '。')
 
     def test_extra_space(self):
-        self.check('很久 以前，有一个皇帝。', '很久以前，有一个皇帝。', '很久以前，有一个皇帝。')
+        self.check('很久 以前，有一个皇帝。', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个皇帝') + '。')
 
     def test_multiple_errors(self):
-        self.check('很久以前有一个狗', '很久以前，有一个皇帝。', "很久以前，有一个<span class='diff-del'>狗</span><span class='diff-ins'>皇</span>帝。")
+        self.check('很久以前有一个狗', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个') + span('ins', '皇') + span('del', '狗') + span('ins', '帝') + '。')
 
     def test_all_highlights(self):
-        self.check('很久以前有一个狗帝帝', '很久以前，有一个皇帝。', "很久以前，有一个<span class='diff-del'>狗</span><span class='diff-ins'>皇</span>帝<span class='diff-del'>帝</span>。")
+        self.check('很久以前有一个狗帝帝', '很久以前，有一个皇帝。', ok('很久以前') + '，' + ok('有一个') + span('extra', '狗') + span('del', '帝') + span('ins', '皇') + ok('帝') + '。')
+
+    def test_extra_characters_at_the_edges(self):
+        self.check('狗「很久。」狗', '「很久。」', '「' + span('extra', '狗') + ok('很久') + '。」')
+        self.check('狗狗', '。', '。')
+
+    def test_engines_match_reference(self):
+        rng = random.Random(7)
+        alphabet = '很久以前有一个皇帝狗'
+        for _ in range(500):
+            user = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 15)))
+            correct = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 15)))
+            expected = dp_align(user, correct)
+            for name, engine in ENGINES.items():
+                self.assertEqual(engine(user, correct), expected, name)
+
+    def test_linear_engine_on_long_inputs(self):
+        rng = random.Random(11)
+        alphabet = '很久以前有一个皇帝狗'
+        correct = ''.join(rng.choice(alphabet) for _ in range(300))
+        user = ''.join(rng.choice(alphabet) if rng.random() < 0.2 else ch for ch in correct[20:])
+        self.assertEqual(linear_align(user, correct), bitparallel_align(user, correct))
+        self.assertEqual(Corrector('dp', linear_threshold=50, cache=None).compare(user, correct),
+                         Corrector('bitparallel', cache=None).compare(user, correct))
+
+    def test_banded_engine_matches_within_budget(self):
+        rng = random.Random(5)
+        alphabet = '很久以前有一个皇帝狗'
+        for _ in range(300):
+            user = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+            correct = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+            expected = dp_align(user, correct)
+            distance = sum(op != 'equal' for op, _, _ in expected)
+            for budget in range(6):
+                self.assertEqual(banded_align(user, correct, budget), expected if distance <= budget else None)
+
+    def test_too_different_answer(self):
+        corrector = Corrector(max_distance_ratio=0.3, cache=None)
+        correction, _, _, correct_segments = corrector.compare('狗狗狗狗狗', '很久以前，有一个皇帝。')
+        self.assertEqual(correction, ''.join(span('ins', ch) for ch in '很久以前') + '，' + ''.join(span('ins', ch) for ch in '有一个皇帝') + '。')
+        self.assertEqual(correct_segments, '')
+        correction, *_ = corrector.compare('很久以前，有一个皇狗。', '很久以前，有一个皇帝。')
+        self.assertEqual(correction, ok('很久以前') + '，' + ok('有一个皇') + span('del', '狗') + span('ins', '帝') + '。')
+
+    def test_cache_keys_on_stripped_input(self):
+        corrector = Corrector(cache=LRUCache(maxsize=1))
+        first = corrector.align('很久以前有一个皇帝', '很久以前，有一个皇帝。')
+        self.assertIs(corrector.align('很久以前， 有一个皇帝。', '很久以前，有一个皇帝。'), first)
+        corrector.align('', '很久以前，有一个皇帝。')
+        self.assertEqual(corrector.cache.stats(), {"size": 1, "maxsize": 1, "hits": 1, "misses": 2, "evictions": 1})
+
+    def test_target_profile(self):
+        target = TargetProfile('「很久以前，有一个皇帝。」')
+        self.assertEqual(target.stripped, '很久以前有一个皇帝')
+        self.assertEqual(target.index_map, (1, 2, 3, 4, 6, 7, 8, 9, 10))
+        self.assertEqual(target.skeleton, ('「', '', '', '', '，', '', '', '', '', '。」'))
+        for user_input in ['很久以前有一个狗', '', '狗很久以前，有一个皇帝帝']:
+            self.assertEqual(Corrector(cache=None).compare(user_input, target),
+                             Corrector(cache=None).compare(user_input, target.text))
+
+    def test_compare_many(self):
+        corrector = Corrector(cache=None)
+        target = TargetProfile('很久以前，有一个皇帝。')
+        pairs = [('很久以前有一个皇帝', target), ('你好', '你好，很高兴认识你'), ('很久以前有一个皇帝', target)]
+        alignments = corrector.compare_many(pairs)
+        self.assertEqual([a.accuracy for a in alignments], [100, 25, 100])
+        for (user_input, correct), alignment in zip(pairs, alignments):
+            self.assertEqual(alignment.as_tuple(), corrector.compare(user_input, correct))
+
+    def test_alignment(self):
+        alignment = Corrector(cache=None).align('很久以前有一个狗帝帝', '很久以前，有一个皇帝。')
+        self.assertEqual(alignment.ops, 'eeeeeeedre')
+        self.assertEqual([alignment.is_correct(k) for k in range(9)], [True] * 7 + [False, True])
+        self.assertEqual(alignment.accuracy, 89)
+        self.assertEqual(alignment.correct_hanzi, frozenset('很久以前有一个帝'))
+        self.assertEqual(alignment.correct_segments, '很久以前有一个帝')
+
+    def test_incremental_aligner_matches_fresh_tables(self):
+        rng = random.Random(11)
+        correct = '很久以前有一个皇帝'
+        aligner = IncrementalAligner(correct)
+        typed = ''
+        for _ in range(300):
+            # Mostly append, sometimes edit or delete like a learner would
+            if typed and rng.random() < 0.3:
+                cut = rng.randrange(len(typed))
+                typed = typed[:cut] + ''.join(rng.choice('很久以前皇帝狗') for _ in range(rng.randint(0, 2)))
+            else:
+                typed += rng.choice('很久以前有一个皇帝狗')
+            typed = typed[:20]
+            aligner.extend(typed)
+            fresh = IncrementalAligner(correct)
+            fresh.extend(typed)
+            self.assertEqual(aligner.rows, fresh.rows)
+            ops, end = aligner.prefix_ops()
+            self.assertEqual(ops, dp_align(typed, correct[:end]))
+
+    def test_align_prefix(self):
+        corrector = Corrector(cache=None, live_cache=LRUCache(8))
+        target = '很久以前，有一个皇帝。'
+        self.assertEqual(corrector.align_prefix('很久', target, 'learner').ops, 'ee')
+        alignment = corrector.align_prefix('很久以钱', target, 'learner')
+        self.assertEqual(alignment.ops, 'eeer')
+        self.assertEqual(alignment.correct_count, 3)
+        self.assertEqual(alignment.html, ok('很久以') + span('del', '钱') + span('ins', '前') + '，')
+        self.assertEqual(render_live(alignment.ops, alignment.stripped_user), ok('很久以') + span('del', '钱'))
+        self.assertEqual(render_live('eie', '很以'), ok('很') + span('ins', '＿') + ok('以'))
+        # The state is reused as long as the sentence stays the same
+        aligner = corrector.live_cache.get('learner')
+        corrector.align_prefix('很久以前，有', target, 'learner')
+        self.assertIs(corrector.live_cache.get('learner'), aligner)
+        self.assertEqual(aligner.s_user, '很久以前有')
+        corrector.align_prefix('你', '你好', 'learner')
+        self.assertIsNot(corrector.live_cache.get('learner'), aligner)
+        # Oversized input is cut to the limit before it reaches the stored state
+        alignment = corrector.align_prefix('你好' + '狗' * 1000, '你好', 'learner')
+        self.assertEqual(len(alignment.stripped_user), live_input_limit(TargetProfile('你好')))
+        self.assertEqual(len(corrector.live_cache.get('learner').rows), 15)
+
+    def test_split_syllables(self):
+        self.assertEqual(split_syllables('Wǒ ài chī píngguǒ.'), ['wo', 'ai', 'chi', 'ping', 'guo'])
+        self.assertEqual(split_syllables('dàngāo'), ['dan', 'gao'])
+        self.assertEqual(split_syllables("Xī'ān"), ['xi', 'an'])
+        self.assertEqual(split_syllables('nǚ yìdiǎnr'), ['nv', 'yi', 'dian', 'er'])
+        self.assertIsNone(split_syllables('rèài'))
+
+    def test_homophones(self):
+        syllables = build_syllable_index([('我明天再来。', 'Wǒ míngtiān zài lái.'), ('他在家。', 'Tā zài jiā.'),
+                                          ('三点', 'three o\'clock')], strip=Corrector(cache=None).strip)
+        self.assertEqual(syllables['再'], 'zai')
+        self.assertIs(syllables['在'], syllables['再'])
+        self.assertNotIn('点', syllables)
+        tolerant = Corrector(cache=None, syllables=syllables)
+        alignment = tolerant.align('我明天在来', '我明天再来。')
+        self.assertEqual(alignment.ops, 'eeehe')
+        self.assertEqual(alignment.accuracy, 90)
+        self.assertEqual(alignment.correct_hanzi, frozenset('我明天来'))
+        self.assertEqual(alignment.html, ok('我明天') + span('homophone', '在') + span('ins', '再') + ok('来') + '。')
+        self.assertEqual(Corrector(cache=None).align('我明天在来', '我明天再来。').accuracy, 80)
+        self.assertEqual(tolerant.align('我明天家来', '我明天再来。').ops, 'eeere')
+
+    def test_trie_matches_best_variant(self):
+        rng = random.Random(13)
+        for _ in range(300):
+            variants = [''.join(rng.choice('一个個人们們呢') for _ in range(rng.randint(0, 8))) for _ in range(rng.randint(1, 4))]
+            s_user = ''.join(rng.choice('一个個人们們呢') for _ in range(rng.randint(0, 8)))
+            distances = [sum(op != 'equal' for op, _, _ in dp_align(s_user, v)) for v in variants]
+            index, ops = trie_align(VariantTrie(variants), s_user)
+            self.assertEqual(index, distances.index(min(distances)))
+            self.assertEqual(ops, dp_align(s_user, variants[index]))
+
+    def test_alternative_answers(self):
+        corrector = Corrector(cache=None)
+        target = TargetProfile('他是一个学生。', ['他是一個學生。', '他是学生。'])
+        self.assertEqual(len(target.variants.ends), 3)
+        alignment = corrector.align('他是一個學生', target)
+        self.assertEqual(alignment.target.text, '他是一個學生。')
+        self.assertEqual(alignment.accuracy, 100)
+        self.assertEqual(alignment.html, ok('他是一個學生') + '。')
+        self.assertEqual(corrector.align('他是学生', target).target.text, '他是学生。')
+        # Ties go to the main sentence
+        self.assertEqual(corrector.align('他是一个学', target).target.text, '他是一个学生。')
+        self.assertEqual(corrector.align('他是一个学', target, max_distance=0).ops, 'i' * 6)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            Corrector('nope')
 
 
 if __name__ == '__main__':
-    unittest.main() 
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,292 @@
+import time
+import unittest
+from datetime import date, timedelta
+from types import SimpleNamespace
+from postgrest.exceptions import APIError
+from dictation import db_helpers
+from dictation.cache import TTLCache
+
+
+class FakeQuery:
+    """Chainable stand-in for a supabase-py table query over in-memory rows"""
+
+    def __init__(self, client, table, rows, insert=None, update=None, orders=(), window=None):
+        self.client = client
+        self.table = table
+        self.rows = rows
+        self.insert_row = insert
+        self.values = update
+        self.orders = orders
+        self.window = window
+
+    def select(self, columns):
+        return self
+
+    def filter(self, keep):
+        return FakeQuery(self.client, self.table, [r for r in self.rows if keep(r)], update=self.values)
+
+    def eq(self, column, value):
+        return self.filter(lambda r: r.get(column) == value)
+
+    def gte(self, column, value):
+        return self.filter(lambda r: r[column] >= value)
+
+    def lte(self, column, value):
+        return self.filter(lambda r: r[column] <= value)
+
+    def contains(self, column, values):
+        return self.filter(lambda r: set(values) <= set(r.get(column) or []))
+
+    def in_(self, column, values):
+        return self.filter(lambda r: r[column] in values)
+
+    def order(self, column, desc=False):
+        return FakeQuery(self.client, self.table, self.rows, update=self.values, orders=self.orders + ((column, desc),))
+
+    def range(self, start, end):
+        return FakeQuery(self.client, self.table, self.rows, update=self.values, orders=self.orders, window=(start, end))
+
+    def update(self, values):
+        return FakeQuery(self.client, self.table, self.rows, update=values)
+
+    def insert(self, row):
+        return FakeQuery(self.client, self.table, [], insert=[row])
+
+    def upsert(self, rows, on_conflict):
+        keys = on_conflict.split(",")
+        for row in rows:
+            self.table[:] = [r for r in self.table if any(r[k] != row[k] for k in keys)]
+        return FakeQuery(self.client, self.table, [], insert=rows)
+
+    def execute(self):
+        self.client.queries += 1
+        if self.insert_row is not None:
+            for row in self.insert_row:
+                self.table.append(dict(row, id=len(self.table) + 1))
+            return SimpleNamespace(data=self.insert_row)
+        if self.values is not None:
+            for row in self.rows:
+                row.update(self.values)
+        rows = list(self.rows)
+        for column, desc in reversed(self.orders):
+            rows.sort(key=lambda r: r[column], reverse=desc)
+        if self.window is not None:
+            rows = rows[self.window[0]:self.window[1] + 1]
+        # PostgREST's max-rows: longer results are cut silently
+        return SimpleNamespace(data=[dict(r) for r in rows[:self.client.max_rows]])
+
+
+class FakeSupabase:
+    def __init__(self, tables, max_rows=1000):
+        self.tables = tables
+        self.queries = 0
+        self.max_rows = max_rows
+
+    def table(self, name):
+        table = self.tables.setdefault(name, [])
+        return FakeQuery(self, table, table)
+
+    def rpc(self, name, params):
+        # No database functions deployed
+        return SimpleNamespace(execute=self.missing_function)
+
+    def missing_function(self):
+        self.queries += 1
+        raise APIError({"code": "PGRST202", "message": "Could not find the function", "hint": None, "details": None})
+
+
+def registry_rows(user_id, days_above_7, today, extra_days=()):
+    """One passing session per day for the last ``days_above_7`` days (today included)"""
+    rows = []
+    for i in range(days_above_7):
+        day = (today - timedelta(days=i)).isoformat()
+        rows.append({"user_id": user_id, "session_date": day, "session_type": "hsk", "sentences_above_7": 1, "total_sentences": 5})
+    for i in extra_days:
+        day = (today - timedelta(days=i)).isoformat()
+        rows.append({"user_id": user_id, "session_date": day, "session_type": "story", "sentences_above_7": 0, "total_sentences": 3})
+    return rows
+
+
+class TestDailyWorkStats(unittest.TestCase):
+    def setUp(self):
+        self.original = db_helpers.supabase
+        self.today = date.today()
+
+    def tearDown(self):
+        db_helpers.supabase = self.original
+
+    def stats(self, rows):
+        db_helpers.supabase = FakeSupabase({"daily_work_registry": [dict(row, id=k) for k, row in enumerate(rows)]})
+        return db_helpers.get_daily_work_stats("user"), db_helpers.supabase.queries
+
+    def test_single_query(self):
+        rows = registry_rows("user", 3, self.today, extra_days=(0, 5)) + registry_rows("other", 10, self.today)
+        stats, queries = self.stats(rows)
+        self.assertEqual(queries, 1)
+        self.assertEqual(stats["today_sentences_above_7"], 1)
+        self.assertEqual(stats["today_total_sentences"], 8)
+        self.assertEqual(stats["current_streak"], 3)
+        self.assertEqual(len(stats["last_7_days"]), 7)
+        self.assertEqual([day["completed"] for day in stats["last_7_days"]], [False] * 4 + [True] * 3)
+        self.assertEqual(stats["last_7_days"][1]["total_sentences"], 3)
+        self.assertEqual(stats["last_7_days"][-1]["date"], self.today.strftime("%a"))
+
+    def test_no_work_today(self):
+        stats, queries = self.stats(registry_rows("user", 0, self.today, extra_days=(0, 1)))
+        self.assertEqual(queries, 1)
+        self.assertEqual(stats["current_streak"], 0)
+        self.assertEqual(stats["today_total_sentences"], 3)
+
+    def test_paged_past_max_rows(self):
+        # An active user: 12 practice sessions a day, more rows than one response holds.
+        # Stored oldest first, so an unordered single query would lose today's.
+        days = db_helpers.STATS_WINDOW_DAYS - 1
+        rows = [row for day in reversed(range(days)) for row in registry_rows("user", 1, self.today - timedelta(days=day)) * 12]
+        self.assertGreater(len(rows), db_helpers.STATS_PAGE_SIZE)
+        stats, queries = self.stats(rows)
+        self.assertEqual(queries, 2)
+        self.assertEqual(stats["today_total_sentences"], 60)
+        self.assertEqual(stats["current_streak"], days)
+        self.assertEqual([day["total_sentences"] for day in stats["last_7_days"]], [60] * 7)
+
+    def test_long_streak(self):
+        window = db_helpers.STATS_WINDOW_DAYS
+        stats, queries = self.stats(registry_rows("user", window + 10, self.today))
+        self.assertEqual(stats["current_streak"], window + 10)
+        self.assertEqual(queries, 2)
+        stats, queries = self.stats(registry_rows("user", window, self.today))
+        self.assertEqual(stats["current_streak"], window)
+
+
+class TestDailySessionCount(unittest.TestCase):
+    def setUp(self):
+        self.original = db_helpers.supabase
+        db_helpers.supabase = FakeSupabase({"daily_work_registry": registry_rows("user", 2, date.today())})
+        db_helpers.daily_session_counts.clear()
+
+    def tearDown(self):
+        db_helpers.supabase = self.original
+        db_helpers.daily_session_counts.clear()
+
+    def test_cached_until_written(self):
+        self.assertEqual(db_helpers.get_daily_session_count("user"), 1)
+        self.assertEqual(db_helpers.get_daily_session_count("user"), 1)
+        self.assertEqual(db_helpers.supabase.queries, 1)
+        db_helpers.update_daily_work_registry("user", "story", 8.0, 5, story_id="1", story_parts_completed=5)
+        queries = db_helpers.supabase.queries
+        self.assertEqual(db_helpers.get_daily_session_count("user"), 2)
+        self.assertEqual(db_helpers.supabase.queries, queries + 1)
+        # Other users have their own entry
+        self.assertEqual(db_helpers.get_daily_session_count("other"), 0)
+
+    def test_ttl_expiry(self):
+        cache = TTLCache(maxsize=4, ttl=0.05)
+        cache.put("key", 3)
+        self.assertEqual(cache.get("key"), 3)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 1))
+        cache.put("key", 0)
+        cache.invalidate("key")
+        self.assertIsNone(cache.get("key"))
+
+    def test_replayed_daily_work_applied_once(self):
+        write = {"user_id": "user", "session_date": date.today().isoformat(), "session_type": "practice",
+                 "sentences_above_7": 1, "total_sentences": 5, "story_id": None, "story_parts_completed": 0}
+        for key in ("k1", "k1", "k2", "k2"):
+            db_helpers.apply_daily_work(write, key)
+        # One row per practice session
+        rows = [r for r in db_helpers.supabase.tables["daily_work_registry"] if r["session_type"] == "practice"]
+        self.assertEqual([r["applied_writes"] for r in rows], [["k1"], ["k2"]])
+        story = dict(write, session_type="story", story_id="1", story_parts_completed=5)
+        for key in ("k3", "k3", "k4"):
+            db_helpers.apply_daily_work(story, key)
+        rows = [r for r in db_helpers.supabase.tables["daily_work_registry"] if r["session_type"] == "story"]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]["total_sentences"], rows[0]["story_parts_completed"]), (10, 10))
+        self.assertEqual(rows[0]["applied_writes"], ["k3", "k4"])
+
+    def test_permanent_errors(self):
+        def error(code):
+            return APIError({"code": code, "message": "", "hint": None, "details": None})
+        for code in ("42501", "23505", "PGRST204", "400"):
+            self.assertTrue(db_helpers.is_permanent_error(error(code)), code)
+        for code in ("PGRST000", "57014", "40001", "503", "429", None):
+            self.assertFalse(db_helpers.is_permanent_error(error(code)), code)
+        self.assertFalse(db_helpers.is_permanent_error(ConnectionError("Supabase unreachable")))
+
+    def test_applied_writes_bounded(self):
+        row = {"applied_writes": [str(k) for k in range(30)]}
+        kept = db_helpers.applied_writes(row, "new")["applied_writes"]
+        self.assertEqual(len(kept), db_helpers.APPLIED_WRITES_KEPT)
+        self.assertEqual(kept[-2:], ["29", "new"])
+        self.assertEqual(db_helpers.applied_writes(row, None), {})
+
+
+class TestCharacterProgress(unittest.TestCase):
+    def setUp(self):
+        self.original = db_helpers.supabase
+        db_helpers.supabase = FakeSupabase({"character_progress": [
+            {"user_id": "user", "hanzi": "你", "hsk_level": 1, "grade": 2},
+            {"user_id": "user", "hanzi": "好", "hsk_level": 1, "grade": 0},
+            {"user_id": "other", "hanzi": "再", "hsk_level": 1, "grade": 3},
+        ]})
+        # Read-modify-write fallback; the Postgres function is tested in test_grade_function.py
+        db_helpers.grade_function_available = False
+
+    def tearDown(self):
+        db_helpers.supabase = self.original
+        db_helpers.grade_function_available = True
+
+    def grades(self, user_id):
+        return {r["hanzi"]: r["grade"] for r in db_helpers.supabase.tables["character_progress"] if r["user_id"] == user_id}
+
+    def test_next_grade(self):
+        self.assertEqual(db_helpers.next_grade(None, True), 0)
+        self.assertEqual(db_helpers.next_grade(None, False), -1)
+        self.assertEqual(db_helpers.next_grade(3, True), 3)
+        self.assertEqual(db_helpers.next_grade(1, False), 0)
+        self.assertEqual(db_helpers.next_grade(0, False), 0)
+
+    def test_answers_replayed_in_order(self):
+        db_helpers.apply_character_progress("user", {
+            "你": (1, [True, True]),
+            "好": (1, [True, False, True]),
+            "再": (2, [False, True]),
+        })
+        self.assertEqual(db_helpers.supabase.queries, 2)
+        self.assertEqual(self.grades("user"), {"你": 3, "好": 1, "再": 0})
+        self.assertEqual(self.grades("other"), {"再": 3})
+
+    def test_falls_back_without_grade_function(self):
+        db_helpers.grade_function_available = True
+        with self.assertLogs(level="WARNING"):
+            db_helpers.apply_character_progress("user", {"你": (1, [True])})
+        self.assertFalse(db_helpers.grade_function_available)
+        self.assertEqual(self.grades("user")["你"], 3)
+        db_helpers.apply_character_progress("user", {"你": (1, [False])})
+        self.assertEqual(self.grades("user")["你"], 2)
+        self.assertEqual(db_helpers.supabase.queries, 5)
+
+    def test_replayed_write_applied_once(self):
+        answers = {"好": (1, [True]), "再": (1, [True])}
+        db_helpers.apply_character_progress("user", answers, write_key="k1")
+        db_helpers.apply_character_progress("user", answers, write_key="k1")
+        self.assertEqual(self.grades("user"), {"你": 2, "好": 1, "再": 0})
+        db_helpers.apply_character_progress("user", {"好": (1, [True])}, write_key="k2")
+        self.assertEqual(self.grades("user")["好"], 2)
+        row = next(r for r in db_helpers.supabase.tables["character_progress"] if r["hanzi"] == "好" and r["user_id"] == "user")
+        self.assertEqual(row["applied_writes"], ["k1", "k2"])
+
+    def test_batch_update_coalesces_duplicates(self):
+        db_helpers.batch_update_character_progress("user", [
+            {"hanzi": "好", "hsk_level": 1, "correct": True},
+            {"hanzi": "好", "hsk_level": 1, "correct": True},
+        ])
+        self.assertEqual(self.grades("user")["好"], 2)
+        self.assertEqual(len(db_helpers.supabase.tables["character_progress"]), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
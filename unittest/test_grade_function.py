@@ -0,0 +1,113 @@
+import json
+import os
+import random
+import re
+import sqlite3
+import unittest
+from types import SimpleNamespace
+from dictation import db_helpers
+
+SQL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "developer_tools", "create_apply_character_answers.sql")
+
+
+def function_upsert():
+    """The upsert of apply_character_answers, its plpgsql variables turned into SQLite parameters"""
+    with open(SQL_PATH, encoding="utf-8") as f:
+        sql = f.read()
+    statement = re.search(r"-- begin upsert\n(.*?)\n\s*-- end upsert", sql, re.S).group(1)
+    return re.sub(r"\b(p_user_id|v_hanzi|v_hsk_level|v_correct)\b", r":\1", statement)
+
+
+class SQLiteGradeStandIn:
+    """
+    Local stand-in for Supabase's apply_character_answers RPC. The upsert that
+    moves the grades is the function's own statement, run by SQLite (same
+    INSERT ... ON CONFLICT DO UPDATE syntax); the loop around it and the
+    applied_writes bookkeeping (a Postgres array, JSON here) are in Python.
+    """
+
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        self.conn.execute("attach ':memory:' as public")
+        self.conn.execute("""
+            create table public.character_progress (
+                id integer primary key,
+                user_id text not null,
+                hanzi text not null,
+                hsk_level int,
+                grade int not null default -1,
+                last_seen text,
+                applied_writes text not null default '[]',
+                unique (user_id, hanzi)
+            )""")
+        self.conn.create_function("now", 0, lambda: "now")
+        self.conn.create_function("least", 2, min)
+        self.conn.create_function("greatest", 2, max)
+        self.upsert = function_upsert()
+        self.calls = 0
+
+    def rpc(self, name, params):
+        self.calls += 1
+        return SimpleNamespace(execute=lambda: getattr(self, name)(**params))
+
+    def apply_character_answers(self, p_user_id, p_answers, p_write_key=None):
+        with self.conn:
+            self.conn.execute("begin")
+            rows = self.conn.execute("select hanzi, applied_writes from public.character_progress where user_id = ?", (p_user_id,))
+            skipped = {hanzi for hanzi, keys in rows if p_write_key in json.loads(keys)}
+            written = []
+            for answer in p_answers:
+                if answer["hanzi"] in skipped:
+                    continue
+                self.conn.execute(self.upsert, {"p_user_id": p_user_id, "v_hanzi": answer["hanzi"],
+                                                "v_hsk_level": answer["hsk_level"], "v_correct": answer["correct"]})
+                written.append(answer["hanzi"])
+            if p_write_key is not None:
+                for hanzi in dict.fromkeys(written):
+                    keys, = self.conn.execute("select applied_writes from public.character_progress where user_id = ? and hanzi = ?",
+                                              (p_user_id, hanzi)).fetchone()
+                    keys = (json.loads(keys) + [p_write_key])[-db_helpers.APPLIED_WRITES_KEPT:]
+                    self.conn.execute("update public.character_progress set applied_writes = ? where user_id = ? and hanzi = ?",
+                                      (json.dumps(keys), p_user_id, hanzi))
+
+    def grades(self, user_id):
+        return dict(self.conn.execute("select hanzi, grade from public.character_progress where user_id = ?", (user_id,)))
+
+
+class TestGradeFunction(unittest.TestCase):
+    def setUp(self):
+        self.original = db_helpers.supabase
+        db_helpers.supabase = self.db = SQLiteGradeStandIn()
+        db_helpers.grade_function_available = True
+
+    def tearDown(self):
+        db_helpers.supabase = self.original
+
+    def test_matches_next_grade(self):
+        rng = random.Random(7)
+        expected = {}
+        for _ in range(200):
+            answers = {}
+            for hanzi in rng.sample("你好我们他再在见", rng.randint(1, 5)):
+                answers[hanzi] = (1, [rng.random() < 0.6 for _ in range(rng.randint(1, 3))])
+                for correct in answers[hanzi][1]:
+                    expected[hanzi] = db_helpers.next_grade(expected.get(hanzi), correct)
+            db_helpers.apply_character_progress("user", answers)
+            self.assertEqual(self.db.grades("user"), expected)
+        self.assertEqual(self.db.calls, 200)
+        self.assertTrue(db_helpers.grade_function_available)
+
+    def test_write_key_applied_once(self):
+        answers = {"你": (1, [True, True]), "好": (2, [False])}
+        db_helpers.apply_character_progress("user", answers, write_key="k1")
+        db_helpers.apply_character_progress("user", answers, write_key="k1")
+        self.assertEqual(self.db.grades("user"), {"你": 1, "好": -1})
+        db_helpers.apply_character_progress("user", {"你": (1, [True])}, write_key="k2")
+        self.assertEqual(self.db.grades("user"), {"你": 2, "好": -1})
+        keys = self.db.conn.execute("select applied_writes from public.character_progress where hanzi = '你'").fetchone()[0]
+        self.assertEqual(json.loads(keys), ["k1", "k2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
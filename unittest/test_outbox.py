@@ -0,0 +1,160 @@
+import os
+import tempfile
+import time
+import unittest
+from dictation.outbox import Outbox
+
+
+class FlakyBackend:
+    """Handler that records applied payloads and fails while ``down``"""
+
+    def __init__(self):
+        self.applied = []
+        self.down = False
+        self.error = ConnectionError("Supabase unreachable")
+
+    def __call__(self, payload, key):
+        if self.down:
+            raise self.error
+        self.applied.append((payload, key))
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "outbox.sqlite3")
+        self.backend = FlakyBackend()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def outbox(self, **options):
+        outbox = Outbox(self.path, **options)
+        outbox.register("write", self.backend)
+        # Replay by hand instead of from the background thread
+        outbox.stop()
+        return outbox
+
+    def test_replays_in_order(self):
+        # Nothing is opened until the outbox is used (gunicorn forks workers after import)
+        Outbox(self.path)
+        self.assertFalse(os.path.exists(self.path))
+        outbox = self.outbox()
+        keys = [outbox.record("write", {"n": n}) for n in range(3)]
+        self.assertEqual(outbox.stats()["pending"], 3)
+        self.assertEqual(outbox.replay(), 3)
+        self.assertEqual(self.backend.applied, [({"n": n}, key) for n, key in zip(range(3), keys)])
+        self.assertEqual(outbox.stats()["pending"], 0)
+        self.assertEqual(outbox.replay(), 0)
+
+    def test_backoff_keeps_order(self):
+        outbox = self.outbox(base_delay=0.05)
+        outbox.record("write", {"n": 1})
+        outbox.record("write", {"n": 2})
+        self.backend.down = True
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(outbox.replay(), 0)
+        stats = outbox.stats()
+        self.assertEqual((stats["pending"], stats["failures"]), (2, 1))
+        self.assertIn("unreachable", stats["last_error"])
+        self.backend.down = False
+        # The head entry is backing off: nothing behind it is applied either
+        self.assertEqual(outbox.replay(), 0)
+        time.sleep(0.1)
+        self.assertEqual(outbox.replay(), 2)
+        self.assertEqual([payload["n"] for payload, _ in self.backend.applied], [1, 2])
+
+    def test_backoff_grows(self):
+        outbox = self.outbox(base_delay=10, max_delay=25)
+        outbox.record("write", {})
+        self.backend.down = True
+        delays = []
+        with self.assertLogs(level="ERROR"):
+            for _ in range(3):
+                conn = outbox._connection()
+                conn.execute("update outbox set next_attempt = 0")
+                outbox.replay()
+                delays.append(conn.execute("select next_attempt from outbox").fetchone()[0] - time.time())
+        self.assertTrue(7 < delays[0] < 13)
+        self.assertTrue(15 < delays[1] < 25)
+        self.assertTrue(19 < delays[2] < 31)
+
+    def test_poison_entry_does_not_block(self):
+        outbox = self.outbox(base_delay=0, max_attempts=3)
+        outbox.register("rejected", self.backend, is_permanent=lambda e: isinstance(e, PermissionError))
+        outbox.record("unknown", {"n": 0})
+        outbox.record("write", {"n": 1})
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(outbox.replay(), 1)
+        # Permanent errors are not retried, other ones up to max_attempts
+        self.backend.down = True
+        outbox.record("write", {"n": 2})
+        with self.assertLogs(level="ERROR"):
+            for _ in range(3):
+                self.assertEqual(outbox.replay(), 0)
+        self.backend.down = False
+        rejected = FlakyBackend()
+        rejected.error = PermissionError("new row violates row-level security policy")
+        rejected.down = True
+        outbox.register("rejected", rejected, is_permanent=lambda e: isinstance(e, PermissionError))
+        outbox.record("rejected", {"n": 3})
+        outbox.record("write", {"n": 4})
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(outbox.replay(), 1)
+        self.assertEqual([payload["n"] for payload, _ in self.backend.applied], [1, 4])
+        stats = outbox.stats()
+        self.assertEqual((stats["pending"], stats["dead"]), (0, 3))
+        # Dead entries are kept and can be put back in order
+        self.assertEqual(outbox.requeue_dead(), 3)
+        outbox.register("unknown", self.backend)
+        outbox.register("rejected", self.backend)
+        self.assertEqual(outbox.replay(), 3)
+        self.assertEqual([payload["n"] for payload, _ in self.backend.applied], [1, 4, 0, 2, 3])
+
+    def test_flush_before_reading(self):
+        outbox = self.outbox(base_delay=10)
+        outbox.record("write", {"user_id": "a", "n": 1})
+        outbox.record("write", {"user_id": "b", "n": 2})
+        self.assertTrue(outbox.flush("b"))
+        self.assertEqual([payload["n"] for payload, _ in self.backend.applied], [1, 2])
+        # Nothing pending for this user: no replay at all
+        self.backend.down = True
+        outbox.record("write", {"user_id": "c", "n": 3})
+        self.assertTrue(outbox.flush("b"))
+        start = time.monotonic()
+        with self.assertLogs(level="ERROR"):
+            self.assertFalse(outbox.flush())
+        # Backing off: the page is not held for the timeout
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(outbox.stats()["pending"], 1)
+
+    def test_replays_pending_entries_on_start(self):
+        self.outbox().record("write", {"n": 1})
+        # A new worker after a deploy: nothing is recorded, the pending entry is still replayed
+        outbox = Outbox(self.path, poll_interval=0.05)
+        outbox.register("write", self.backend)
+        self.assertTrue(outbox.start())
+        try:
+            for _ in range(100):
+                if self.backend.applied:
+                    break
+                time.sleep(0.01)
+        finally:
+            outbox.stop()
+        self.assertEqual([payload for payload, _ in self.backend.applied], [{"n": 1}])
+        self.assertFalse(outbox.start())
+
+    def test_survives_restart_and_single_replayer(self):
+        first = self.outbox()
+        first.record("write", {"n": 1})
+        self.assertEqual(first._acquire_lease(), True)
+        # Another worker sharing the file waits for the lease
+        second = self.outbox()
+        self.assertEqual(second.replay(), 0)
+        first.stop()
+        self.assertEqual(second.replay(), 1)
+        self.assertEqual(self.backend.applied[0][0], {"n": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
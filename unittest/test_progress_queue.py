@@ -0,0 +1,87 @@
+import threading
+import time
+import unittest
+from dictation.progress_queue import ProgressWriteQueue
+
+
+class RecordingWriter:
+    def __init__(self, fail_for=()):
+        self.calls = []
+        self.fail_for = fail_for
+        self.written = threading.Event()
+
+    def __call__(self, user_id, answers):
+        if user_id in self.fail_for:
+            raise RuntimeError("backend unavailable")
+        self.calls.append((user_id, {hanzi: (level, list(outcomes)) for hanzi, (level, outcomes) in answers.items()}))
+        self.written.set()
+
+
+def updates(*answers):
+    return [{"hanzi": hanzi, "hsk_level": 1, "correct": correct} for hanzi, correct in answers]
+
+
+class TestProgressWriteQueue(unittest.TestCase):
+    def test_coalesces_per_user_and_hanzi(self):
+        writer = RecordingWriter()
+        queue = ProgressWriteQueue(writer, flush_interval=60)
+        queue.enqueue("a", updates(("你", True), ("好", False)))
+        queue.enqueue("a", updates(("你", False)))
+        queue.enqueue("b", updates(("你", True)))
+        self.assertEqual(queue.stats()["depth"], 3)
+        self.assertEqual(queue.stats()["coalesced"], 1)
+        self.assertEqual(writer.calls, [])
+        queue.drain()
+        self.assertEqual(sorted(writer.calls), [
+            ("a", {"你": (1, [True, False]), "好": (1, [False])}),
+            ("b", {"你": (1, [True])}),
+        ])
+        stats = queue.stats()
+        self.assertEqual((stats["depth"], stats["written"], stats["flushes"]), (0, 3, 1))
+        # Once drained, updates are written synchronously
+        queue.enqueue("a", updates(("再", True)))
+        self.assertEqual(writer.calls[-1], ("a", {"再": (1, [True])}))
+
+    def test_flush_single_user(self):
+        writer = RecordingWriter()
+        queue = ProgressWriteQueue(writer, flush_interval=60)
+        queue.enqueue("a", updates(("你", True)))
+        queue.enqueue("b", updates(("好", True)))
+        queue.flush("a")
+        self.assertEqual(writer.calls, [("a", {"你": (1, [True])})])
+        self.assertEqual(queue.stats()["depth"], 1)
+        queue.drain()
+
+    def test_background_flush(self):
+        writer = RecordingWriter()
+        queue = ProgressWriteQueue(writer, flush_interval=0.01)
+        queue.enqueue("a", updates(("你", True)))
+        self.assertTrue(writer.written.wait(2))
+        self.assertEqual(writer.calls, [("a", {"你": (1, [True])})])
+        queue.drain()
+        self.assertFalse(queue._thread.is_alive())
+
+    def test_max_depth_wakes_the_writer(self):
+        writer = RecordingWriter()
+        queue = ProgressWriteQueue(writer, flush_interval=60, max_depth=2)
+        queue.enqueue("a", updates(("你", True)))
+        time.sleep(0.05)
+        self.assertEqual(writer.calls, [])
+        queue.enqueue("a", updates(("好", True)))
+        self.assertTrue(writer.written.wait(2))
+        queue.drain()
+
+    def test_synchronous_mode_and_failures(self):
+        writer = RecordingWriter(fail_for=("b",))
+        queue = ProgressWriteQueue(writer, flush_interval=0)
+        queue.enqueue("a", updates(("你", True)))
+        self.assertEqual(len(writer.calls), 1)
+        self.assertIsNone(queue._thread)
+        with self.assertLogs(level="ERROR"):
+            queue.enqueue("b", updates(("你", True)))
+        self.assertEqual(queue.stats()["failures"], 1)
+        self.assertEqual(queue.stats()["depth"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()